@@ -0,0 +1,42 @@
+"""
+Describes the machine and package versions a benchmark was run with, so
+saved results can be told apart.
+
+Package versions are looked up from the installed package metadata rather
+than by importing the packages, so describing the environment does not
+import astropy or pandas into a benchmark which does not use them.
+"""
+import os
+import platform
+import time
+from importlib import metadata
+
+PACKAGES = ('numpy', 'astropy', 'pandas')
+
+
+def environment(packages = PACKAGES):
+    """
+    Describes the machine and package versions a benchmark was run with.
+
+    Args:
+        packages - The packages whose versions to record
+
+    Returns:
+        A dict that can be saved as JSON. Packages which are not installed
+        have the version None.
+    """
+    env = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    for name in packages:
+        try:
+            env[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            env[name] = None
+    return env
@@ -0,0 +1,353 @@
+"""
+Animates ESF drift profiles (VIPE1 and VIPN1 against GDALT) through a night.
+
+This follows the FuncAnimation example at the end of PyPlot.py, but instead
+of computing each frame inside animate(), every frame is precomputed into a
+single (frames, parameters, gates) array up front. animate() only swaps the x
+data of the lines, and with blit=True matplotlib restores a cached background
+and redraws just those lines, so all 1379 profiles of the bundled night play
+at interactive rates. The achieved frame rate is tracked while the animation
+plays and printed when the window is closed.
+
+    python ESFAnimation.py ../jul20140820_esf.001.txt
+
+PyPlot.py notes that saving an animation needs an external tool such as
+ffmpeg. export renders the frames without a display, with the Agg backend in
+a pool of worker processes, and writes them as an animated GIF or a sequence
+of PNGs with Pillow, so no external tool is needed:
+
+    python ESFAnimation.py ../jul20140820_esf.001.txt --export night.gif
+
+matplotlib and Pillow are only imported when an animation is made.
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+import ESFCache
+import ESFGrid
+
+DRIFTS = ('VIPE1', 'VIPN1')
+
+
+def _stack(grid, params):
+    """
+    Stacks the parameters of a grid into one (frames, parameters, gates)
+    float array with nan at the masked gates.
+    """
+    return np.ascontiguousarray(np.stack(
+        [grid.data[p].filled(np.nan) for p in params], axis = 1))
+
+
+def _setup_axes(ax, frames, gdalt, params):
+    """
+    Sets fixed limits and labels on ax and adds one line per parameter and
+    a text label for the time.
+
+    Returns:
+        A tuple (lines, label)
+    """
+    ax.set_xlim(np.nanmin(frames), np.nanmax(frames))
+    ax.set_ylim(gdalt[0], gdalt[-1])
+    ax.set_xlabel('Drift (m/s)')
+    ax.set_ylabel('GDALT (km)')
+    lines = [ax.plot(frames[0, i], gdalt, label = p)[0]
+             for i, p in enumerate(params)]
+    ax.legend(loc = 'upper right')
+    label = ax.text(0.02, 0.95, '', transform = ax.transAxes)
+    return lines, label
+
+
+def _set_frame(lines, label, frame, ut):
+    """
+    Points the lines at one frame of the precomputed data.
+    """
+    for line, data in zip(lines, frame):
+        line.set_xdata(data)
+    label.set_text(time.strftime('%Y-%m-%d %H:%M:%S UT', time.gmtime(ut)))
+
+
+class ProfileAnimation(object):
+    """
+    A blitted animation of ESF altitude profiles.
+
+    Args:
+        grid     - An ESFGrid.Grid holding the parameters to animate
+        params   - The parameters to draw, one line each. VIPE1 and VIPN1 by
+                   default.
+        interval - The delay between frames in milliseconds
+        ax       - The axes to draw on. A new figure is made by default.
+        kwargs   - Passed on to FuncAnimation, e.g. repeat = False
+    """
+    def __init__(self, grid, params = DRIFTS, interval = 25, ax = None,
+                 **kwargs):
+        import matplotlib.pyplot as plt
+        import matplotlib.animation as animation
+
+        self.ut = grid.ut
+        self.gdalt = grid.gdalt
+        self.params = params
+        self.frames = _stack(grid, params)
+
+        if (ax is None):
+            fig, ax = plt.subplots()
+        self.ax = ax
+        self.fig = ax.figure
+        self.lines, self.label = _setup_axes(ax, self.frames, self.gdalt,
+                                             params)
+        self.artists = tuple(self.lines) + (self.label,)
+
+        self._times = collections.deque(maxlen = 100)
+        self.animation = animation.FuncAnimation(
+            self.fig, self._animate, frames = len(self.ut),
+            init_func = self._init, interval = interval, blit = True,
+            **kwargs)
+        self.fig.canvas.mpl_connect('close_event', self._report)
+
+    def _init(self):
+        """
+        Blanks the lines so the cached background is clean.
+        """
+        blank = np.full(len(self.gdalt), np.nan)
+        for line in self.lines:
+            line.set_xdata(blank)
+        self.label.set_text('')
+        return self.artists
+
+    def _animate(self, i):
+        """
+        Points the lines at frame i of the precomputed data.
+        """
+        _set_frame(self.lines, self.label, self.frames[i], self.ut[i])
+        self._times.append(time.perf_counter())
+        return self.artists
+
+    def fps(self):
+        """
+        Returns the frame rate achieved over the last 100 frames played, or
+        None if fewer than two frames have been played.
+        """
+        if (len(self._times) < 2):
+            return None
+        return (len(self._times) - 1) / (self._times[-1] - self._times[0])
+
+    def _report(self, event = None):
+        rate = self.fps()
+        if (rate is not None):
+            print('Achieved {:.1f} frames per second'.format(rate))
+
+    def measure_fps(self, n_frames = None):
+        """
+        Measures how fast frames can be rendered by running the same
+        restore-background, draw-artists, blit loop that FuncAnimation runs,
+        without waiting for a timer. Works with any backend, including Agg.
+
+        Args:
+            n_frames - How many frames to render. All of them by default.
+
+        Returns:
+            The rendering rate in frames per second
+        """
+        canvas = self.fig.canvas
+        n_frames = len(self.ut) if n_frames is None else n_frames
+        for artist in self.artists:
+            artist.set_animated(True)
+        self._init()
+        canvas.draw()
+        background = canvas.copy_from_bbox(self.ax.bbox)
+        start = time.perf_counter()
+        for i in range(n_frames):
+            canvas.restore_region(background)
+            for artist in self._animate(i % len(self.ut)):
+                self.ax.draw_artist(artist)
+            canvas.blit(self.ax.bbox)
+        return n_frames / (time.perf_counter() - start)
+
+
+def animate_file(filename, params = DRIFTS, **kwargs):
+    """
+    Reads an ESF text export through the sidecar cache, grids it and makes
+    a ProfileAnimation of it.
+
+    Args:
+        filename - The path to the text export
+        params   - The parameters to animate
+        kwargs   - Passed on to ProfileAnimation
+
+    Returns:
+        The ProfileAnimation
+    """
+    grid = ESFGrid.grid_profiles(ESFCache.cached_read(filename), params)
+    return ProfileAnimation(grid, params, **kwargs)
+
+
+_worker = {}
+
+
+def _init_worker(frames, ut, gdalt, params, figsize, dpi, palette):
+    """
+    Builds the figure a worker process reuses for every frame it renders,
+    and caches its background for blitting.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize = figsize, dpi = dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    lines, label = _setup_axes(ax, frames, gdalt, params)
+    artists = tuple(lines) + (label,)
+    for artist in artists:
+        artist.set_animated(True)
+    canvas.draw()
+    _worker.update(frames = frames, ut = ut, canvas = canvas, ax = ax,
+                   lines = lines, label = label, artists = artists,
+                   background = canvas.copy_from_bbox(fig.bbox),
+                   palette = palette)
+
+
+def _render(i):
+    """
+    Renders frame i on the worker's figure and returns it as an RGB image.
+    """
+    from PIL import Image
+
+    w = _worker
+    w['canvas'].restore_region(w['background'])
+    _set_frame(w['lines'], w['label'], w['frames'][i], w['ut'][i])
+    for artist in w['artists']:
+        w['ax'].draw_artist(artist)
+    buf = w['canvas'].buffer_rgba()
+    return Image.frombuffer('RGBA', (buf.shape[1], buf.shape[0]), buf,
+                            'raw', 'RGBA', 0, 1).convert('RGB')
+
+
+def _render_png(job):
+    """
+    Renders a frame and saves it as a PNG.
+    """
+    i, filename = job
+    _render(i).save(filename)
+    return filename
+
+
+def _render_gif(job):
+    """
+    Renders a frame and returns it encoded as a GIF image block against
+    the shared palette.
+    """
+    from PIL import Image, GifImagePlugin
+
+    i, duration = job
+    image = _render(i).quantize(palette = _worker['palette'],
+                                dither = Image.Dither.NONE)
+    return b''.join(GifImagePlugin.getdata(image, duration = duration))
+
+
+def export(grid, filename, params = DRIFTS, processes = None, fps = 25,
+           figsize = (6.4, 4.8), dpi = 100, frames = None):
+    """
+    Renders an animation of the profiles without a display and saves it as
+    an animated GIF or a sequence of PNGs, using Pillow instead of ffmpeg.
+
+    The frames are rendered with the Agg backend in a pool of worker
+    processes, each of which builds its figure once and then only redraws
+    the lines. Frames are written out as soon as they are rendered, so memory
+    use does not grow with the length of the animation.
+
+    Args:
+        grid      - An ESFGrid.Grid holding the parameters to animate
+        filename  - A .gif file to write, or else a directory to fill with
+                    frame_00000.png, frame_00001.png, ...
+        params    - The parameters to draw, one line each
+        processes - The number of worker processes. Defaults to the number
+                    of CPUs.
+        fps       - The frame rate of the GIF
+        figsize   - The figure size in inches
+        dpi       - The resolution in dots per inch
+        frames    - The indices of the frames to render. All of them by
+                    default.
+
+    Returns:
+        The number of frames written
+    """
+    from PIL import Image, GifImagePlugin
+
+    data = _stack(grid, params)
+    frames = np.arange(len(grid.ut)) if frames is None else frames
+    gif = filename.lower().endswith('.gif')
+    palette = None
+    if (gif):
+        # One palette for the whole GIF, taken from the fullest frame so
+        # that every line colour is in it
+        _init_worker(data, grid.ut, grid.gdalt, params, figsize, dpi, None)
+        fullest = np.isfinite(data).sum(axis = (1, 2)).argmax()
+        palette = _render(fullest).quantize(256, dither = Image.Dither.NONE)
+        duration = int(round(1000.0 / fps))
+        jobs = [(i, duration) for i in frames]
+        render = _render_gif
+    else:
+        os.makedirs(filename, exist_ok = True)
+        jobs = [(i, os.path.join(filename, 'frame_{:05d}.png'.format(n)))
+                for n, i in enumerate(frames)]
+        render = _render_png
+
+    def write(results):
+        if (not gif):
+            return sum(1 for _ in results)
+        header, _ = GifImagePlugin.getheader(palette.copy(), info = {
+            'loop': 0, 'optimize': False})
+        n = 0
+        with open(filename, 'wb') as f:
+            f.write(b''.join(header))
+            for block in results:
+                f.write(block)
+                n += 1
+            f.write(b';')
+        return n
+
+    args = (data, grid.ut, grid.gdalt, params, figsize, dpi, palette)
+    if (processes is None):
+        processes = os.cpu_count() or 1
+    if (processes <= 1):
+        _init_worker(*args)
+        return write(map(render, jobs))
+    chunksize = max(1, len(jobs) // (8 * processes))
+    with multiprocessing.Pool(processes, _init_worker, args) as pool:
+        return write(pool.imap(render, jobs, chunksize))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Animate ESF drift '
+                                     'profiles.')
+    parser.add_argument('filename')
+    parser.add_argument('--interval', type = int, default = 25)
+    parser.add_argument('--measure', action = 'store_true',
+                        help = 'print the rendering rate instead of showing '
+                        'the animation')
+    parser.add_argument('--export', default = None,
+                        help = 'save to this .gif, or directory of PNGs, '
+                        'instead of showing the animation')
+    parser.add_argument('--processes', type = int, default = None)
+    parser.add_argument('--fps', type = int, default = 25)
+    args = parser.parse_args()
+    if (args.export):
+        grid = ESFGrid.grid_profiles(ESFCache.cached_read(args.filename),
+                                     DRIFTS)
+        start = time.perf_counter()
+        n = export(grid, args.export, processes = args.processes,
+                   fps = args.fps)
+        print('Exported {} frames in {:.1f} s'.format(
+            n, time.perf_counter() - start))
+    else:
+        anim = animate_file(args.filename, interval = args.interval)
+        if (args.measure):
+            print('Rendered {:.1f} frames per second'.format(
+                anim.measure_fps()))
+        else:
+            import matplotlib.pyplot as plt
+            plt.show()
@@ -0,0 +1,174 @@
+"""
+Loads many ESF exports at once, for example a season of nightly
+jul*_esf.*.txt / .hdf5 files, by parsing them in a pool of worker processes
+and merging the results into one time sorted table or grid.
+
+Run this module as a script to compare the pool against a plain serial loop
+on synthetic copies of the bundled night:
+
+    python ESFBatch.py --copies 16 --processes 4
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import ESFGrid
+import ESFReader
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           os.pardir, 'jul20140820_esf.001.txt')
+
+
+def read_file(filename):
+    """
+    Reads a single text or HDF5 export into a TABLE_DTYPE array.
+
+    Args:
+        filename - The path to the export
+
+    Returns:
+        A structured array with the dtype ESFReader.TABLE_DTYPE
+    """
+    if (ESFReader.is_hdf5(filename)):
+        return ESFReader.read_hdf5_table(filename)
+    return ESFReader.read_table(filename)
+
+
+def find_files(source):
+    """
+    Expands the files argument of load_files into a sorted list of paths.
+    The text and HDF5 exports of a night share a name, and only the HDF5
+    export is kept when both are there, so each night is read once.
+
+    Args:
+        source - A directory, a glob pattern or a list of paths
+
+    Returns:
+        A sorted list of file names, one per night
+    """
+    if (isinstance(source, str)):
+        if (os.path.isdir(source)):
+            source = [os.path.join(source, name) for name in os.listdir(source)
+                      if name.startswith('jul') and '_esf.' in name]
+        else:
+            source = glob.glob(source)
+    nights = {}
+    for filename in sorted(source):
+        night = os.path.splitext(filename)[0]
+        if (night not in nights or ESFReader.is_hdf5(filename)):
+            nights[night] = filename
+    return sorted(nights.values())
+
+
+def merge_tables(tables):
+    """
+    Concatenates tables and sorts the rows by time. The sort is stable, so
+    rows with the same time keep the order of the files they came from.
+
+    Args:
+        tables - A list of TABLE_DTYPE arrays
+
+    Returns:
+        A tuple (table, ut) of the merged table and the UT time of each row
+    """
+    if (not tables):
+        return np.empty(0, dtype = ESFReader.TABLE_DTYPE), np.empty(0, 'i8')
+    table = np.concatenate(tables)
+    ut = ESFReader.unix_time(table)
+    order = np.argsort(ut, kind = 'stable')
+    return table[order], ut[order]
+
+
+def load_files(files, processes = None, chunksize = 1, grid = False,
+               params = ESFGrid.MEASURED):
+    """
+    Parses a set of exports in parallel and merges them into one table.
+
+    The files are handed out to the workers in sorted order and the results
+    are collected in that same order before a stable sort on time, so the
+    output does not depend on the number of workers or which finishes first.
+
+    Args:
+        files     - A directory, a glob pattern or a list of paths
+        processes - The number of worker processes. Defaults to the number of
+                    cores. With 1 the files are read in this process.
+        chunksize - How many files each worker is given at a time
+        grid      - If True, return an ESFGrid.Grid rather than a table
+        params    - The parameters to grid when grid is True
+
+    Returns:
+        A time sorted structured array with the dtype ESFReader.TABLE_DTYPE,
+        or an ESFGrid.Grid of it when grid is True
+    """
+    files = find_files(files)
+    if (processes is None):
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(files))
+    if (processes <= 1):
+        tables = [read_file(filename) for filename in files]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            tables = pool.map(read_file, files, chunksize)
+    table, ut = merge_tables(tables)
+    if (grid):
+        return ESFGrid.grid_profiles(table, params, ut = ut)
+    return table
+
+
+def benchmark(copies = 8, processes = None, chunksize = 1, sample = SAMPLE_FILE):
+    """
+    Times load_files against a serial loop over synthetic copies of a sample
+    export and prints the speedup.
+
+    Args:
+        copies    - How many copies of the sample to load
+        processes - The number of worker processes, see load_files
+        chunksize - Files per worker task, see load_files
+        sample    - The export to copy. The bundled night by default.
+
+    Returns:
+        A dict with the serial and parallel times in seconds and the speedup
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ext = os.path.splitext(sample)[1]
+        for i in range(copies):
+            shutil.copy(sample, os.path.join(
+                tmpdir, 'jul20140820_esf.{:03d}{}'.format(i, ext)))
+
+        start = time.perf_counter()
+        serial, _ = merge_tables([read_file(filename)
+                                  for filename in find_files(tmpdir)])
+        t_serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parallel = load_files(tmpdir, processes, chunksize)
+        t_parallel = time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if (serial.tobytes() != parallel.tobytes()):
+        raise RuntimeError('Parallel and serial loads gave different tables')
+    result = {'copies': copies, 'processes': processes or os.cpu_count(),
+              'serial': t_serial, 'parallel': t_parallel,
+              'speedup': t_serial / t_parallel}
+    print('{copies} files, {processes} processes: serial {serial:.3f} s, '
+          'parallel {parallel:.3f} s, speedup {speedup:.2f}x'.format(**result))
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compare parallel and '
+                                     'serial loading of ESF exports.')
+    parser.add_argument('--copies', type = int, default = 8)
+    parser.add_argument('--processes', type = int, default = None)
+    parser.add_argument('--chunksize', type = int, default = 1)
+    parser.add_argument('--sample', default = SAMPLE_FILE)
+    args = parser.parse_args()
+    benchmark(args.copies, args.processes, args.chunksize, args.sample)
@@ -0,0 +1,160 @@
+"""
+A binary sidecar cache for parsed ESF text exports.
+
+Parsing the fixed-width text is far slower than loading the same numbers
+from a binary file (see the reader timings in Reading_Writing). The first
+time a file is parsed, the resulting array is saved as a .npy sidecar in a
+cache directory, and later loads memory map that sidecar instead.
+
+A sidecar is named after the absolute path of the text file and the parser
+that produced it, plus a hash of the file size, modification time and parser
+version. Editing the file, or bumping ESFReader.PARSER_VERSION, therefore
+changes the expected name and the old sidecar is replaced the next time the
+file is loaded. Sidecars which cannot be loaded are rebuilt as well.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+import ESFReader
+import Instrument
+
+CACHE_DIRNAME = '.esf_cache'
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+
+def _digest(text):
+    """
+    Returns a short hex digest of a string, used in sidecar names.
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def sidecar_path(filename, parser = ESFReader.read_table,
+                 version = ESFReader.PARSER_VERSION, cache_dir = None):
+    """
+    Works out where the sidecar for a file should live.
+
+    Args:
+        filename  - The path to the text file
+        parser    - The function used to parse the file
+        version   - The version of the parser
+        cache_dir - The cache directory. By default a directory called
+                    .esf_cache next to the text file.
+
+    Returns:
+        A tuple of (prefix, path). All sidecars of this file and parser start
+        with prefix, path is the one matching the current state of the file.
+    """
+    path = os.path.abspath(filename)
+    if (cache_dir is None):
+        cache_dir = os.path.join(os.path.dirname(path), CACHE_DIRNAME)
+    st = os.stat(path)
+    prefix = os.path.join(cache_dir, _digest('{}|{}.{}'.format(
+        path, parser.__module__, parser.__name__)))
+    state = _digest('{}|{}|{}'.format(st.st_size, st.st_mtime_ns, version))
+    return prefix, '{}-{}.npy'.format(prefix, state)
+
+
+def evict(cache_dir, max_bytes, keep = (), pattern = '*.npy'):
+    """
+    Removes the least recently used entries from a cache directory until the
+    entries take up no more than max_bytes. Entries are ordered by their
+    modification time, which is refreshed every time an entry is used.
+
+    Args:
+        cache_dir - The cache directory
+        max_bytes - The maximum total size of the entries, in bytes
+        keep      - Paths which must not be removed
+        pattern   - A glob pattern matching the cache entries
+
+    Returns:
+        A list of the paths that were removed
+    """
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, pattern)):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    keep = set(os.path.abspath(path) for path in keep)
+    removed = []
+    for _, size, path in entries:
+        if (total <= max_bytes):
+            break
+        if (os.path.abspath(path) in keep):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed.append(path)
+    return removed
+
+
+def _load(sidecar):
+    """
+    Memory maps a sidecar, returning None if it is missing or unreadable.
+    """
+    try:
+        data = np.load(sidecar, mmap_mode = 'r', allow_pickle = False)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, EOFError):
+        os.remove(sidecar)
+        return None
+    os.utime(sidecar)
+    return data
+
+
+@Instrument.instrument
+def cached_read(filename, parser = ESFReader.read_table,
+                version = ESFReader.PARSER_VERSION, cache_dir = None,
+                max_bytes = DEFAULT_MAX_BYTES):
+    """
+    Parses a text file through the sidecar cache. The first call runs the
+    parser and saves its output, later calls memory map the saved copy until
+    the file, or the parser version, changes.
+
+    Args:
+        filename  - The path to the text file
+        parser    - A function taking the file name and returning an array.
+                    ESFReader.read_table by default.
+        version   - The version of the parser. Bump it when the parser output
+                    changes so existing sidecars are rebuilt.
+        cache_dir - The cache directory. By default a directory called
+                    .esf_cache next to the text file.
+        max_bytes - The cache directory is kept below this size by removing
+                    the least recently used sidecars. 512 MB by default.
+
+    Returns:
+        The parsed array, as a read-only memory map of the sidecar
+    """
+    prefix, sidecar = sidecar_path(filename, parser, version, cache_dir)
+    data = _load(sidecar)
+    if (data is not None):
+        return data
+
+    data = parser(filename)
+    cache_dir = os.path.dirname(sidecar)
+    os.makedirs(cache_dir, exist_ok = True)
+    for stale in glob.glob(prefix + '-*.npy'):
+        if (stale != sidecar):
+            os.remove(stale)
+    fd, tmp = tempfile.mkstemp(dir = cache_dir, suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, data, allow_pickle = False)
+        os.replace(tmp, sidecar)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    evict(cache_dir, max_bytes, keep = [sidecar])
+    return np.load(sidecar, mmap_mode = 'r', allow_pickle = False)
@@ -0,0 +1,242 @@
+"""
+Fits the drift of every ESF profile against altitude in one batched weighted
+least squares solve.
+
+Each profile gets a low order polynomial v(z) = c[0] z**deg + ... + c[deg],
+weighted by 1 / error**2 with DVIPE1 or DVIPN1 as the error, ignoring masked
+gates. Looping np.polyfit over the 1379 profiles of a night spends almost all
+its time in per-call overhead. Here the sums making up the normal equations
+of every profile are gathered with np.bincount over the valid gates of all
+profiles at once, and the equations are then solved together with one call
+to np.linalg.solve.
+
+The altitudes of each profile are centred and scaled before fitting to keep
+the normal equations well conditioned, and the coefficients and covariances
+are transformed back, so they are in the same order and units as
+np.polyfit's.
+
+Run this module as a script to compare it with a loop over np.polyfit:
+
+    python ESFFit.py ../jul20140820_esf.001.txt --deg 2
+"""
+import argparse
+import time
+from collections import namedtuple
+from math import comb
+
+import numpy as np
+
+import ESFCache
+import ESFGrid
+import ESFReader
+import Instrument
+
+Fit = namedtuple('Fit', ['coef', 'cov', 'n', 'chi2'])
+
+
+def _unscale(centre, scale, deg):
+    """
+    Returns, for each row, the matrix taking ascending coefficients in
+    x = (z - centre) / scale to ascending coefficients in z.
+    """
+    T = np.zeros((len(centre), deg + 1, deg + 1))
+    for k in range(deg + 1):
+        for j in range(k + 1):
+            # The z**j term of ((z - centre) / scale)**k
+            T[:, j, k] = comb(k, j) * (-centre)**(k - j) / scale**k
+    return T
+
+
+def _data(a):
+    """
+    Returns the values of a possibly masked array as floats, with a mask of
+    the values which are masked or not finite.
+    """
+    a = np.ma.asarray(a)
+    values = np.asarray(np.ma.getdata(a), dtype = 'f8')
+    return values, np.ma.getmaskarray(a) | ~np.isfinite(values)
+
+
+@Instrument.instrument
+def stacked_polyfit(x, y, sigma, deg = 1, scale_cov = False):
+    """
+    Fits a polynomial to each row of y in one batched solve.
+
+    Each row is centred and scaled to [-1, 1] over the gates it has, and the
+    sums of w x**k it needs for its normal equations are gathered for all
+    rows at once with np.bincount over just the valid values.
+
+    Args:
+        x         - The abscissae shared by every row, shape (gates,)
+        y         - The values, shape (rows, gates). Masked or nan values are
+                    left out.
+        sigma     - The errors of y, the same shape. Values with a masked,
+                    nan, zero or negative error are left out.
+        deg       - The degree of the polynomial
+        scale_cov - If False the covariances are (A^T W A)^-1, treating sigma
+                    as absolute errors, like np.polyfit with cov = 'unscaled'.
+                    If True they are also multiplied by the reduced chi
+                    squared, like cov = True.
+
+    Returns:
+        A Fit named tuple of (coef, cov, n, chi2). coef has shape
+        (rows, deg + 1) in np.polyfit order, highest power first, and cov has
+        shape (rows, deg + 1, deg + 1). n is the number of values used in each
+        row and chi2 the weighted sum of squared residuals. Rows with fewer
+        than deg + 1 values have nan coefficients and covariances, and with
+        scale_cov rows with exactly deg + 1 values have nan covariances.
+    """
+    x = np.asarray(x, dtype = 'f8')
+    y, bad = _data(y)
+    sigma, bad_sigma = _data(sigma)
+    with np.errstate(invalid = 'ignore'):
+        good = ~bad & ~bad_sigma & (sigma > 0) & np.isfinite(x)
+    rows, cols = np.nonzero(good)
+    n_rows, m = len(y), deg + 1
+    yv, xv = y[rows, cols], x[cols]
+    wv = 1 / sigma[rows, cols]**2
+
+    n = np.bincount(rows, minlength = n_rows)
+    ok = n >= m
+    starts = np.r_[0, np.cumsum(n)[:-1]][n > 0]
+    low = np.zeros(n_rows)
+    high = np.ones(n_rows)
+    if (len(starts)):
+        low[n > 0] = np.minimum.reduceat(xv, starts)
+        high[n > 0] = np.maximum.reduceat(xv, starts)
+    centre = (high + low) / 2
+    scale = (high - low) / 2
+    scale[scale == 0] = 1
+    xv = (xv - centre[rows]) / scale[rows]
+
+    moments = np.empty((n_rows, 2 * deg + 1))
+    rhs = np.empty((n_rows, m))
+    power = wv.copy()
+    for k in range(2 * deg + 1):
+        moments[:, k] = np.bincount(rows, power, n_rows)
+        if (k < m):
+            rhs[:, k] = np.bincount(rows, power * yv, n_rows)
+        power *= xv
+    index = np.arange(m)
+    normal = moments[:, index[:, None] + index[None, :]]
+    normal[~ok] = np.eye(m)
+    rhs[~ok] = 0
+    coef = np.linalg.solve(normal, rhs[:, :, None])[:, :, 0]
+    cov = np.linalg.inv(normal)
+
+    fitted = np.zeros(len(xv))
+    for k in range(deg, -1, -1):
+        fitted = fitted * xv + coef[rows, k]
+    chi2 = np.bincount(rows, wv * (yv - fitted)**2, n_rows)
+    if (scale_cov):
+        # Rows with no spare degrees of freedom have no scaled covariance
+        spare = np.where(n > m, n - m, 1)
+        cov *= np.where(n > m, chi2 / spare, np.nan)[:, None, None]
+
+    T = _unscale(centre, scale, deg)
+    coef = (T @ coef[:, :, None])[:, ::-1, 0]
+    cov = (T @ cov @ T.transpose(0, 2, 1))[:, ::-1, ::-1]
+    coef[~ok] = np.nan
+    cov[~ok] = np.nan
+    return Fit(coef, cov, n, chi2)
+
+
+def fit_profiles(grid, param = 'VIPE1', deg = 1, low = None, high = None,
+                 scale_cov = False):
+    """
+    Fits a polynomial in altitude to every profile of a drift parameter,
+    weighted by its errors.
+
+    Args:
+        grid      - An ESFGrid.Grid with the parameter and its error
+        param     - 'VIPE1' or 'VIPN1'
+        deg       - The degree of the polynomial, 1 for a linear fit
+        low       - The lowest altitude to fit in km. All gates by default.
+        high      - The highest altitude to fit in km
+        scale_cov - See stacked_polyfit
+
+    Returns:
+        A Fit named tuple, see stacked_polyfit. The coefficients are in
+        m/s per km**k.
+    """
+    gates = np.ones(len(grid.gdalt), dtype = bool)
+    if (low is not None):
+        gates &= grid.gdalt >= low
+    if (high is not None):
+        gates &= grid.gdalt <= high
+    return stacked_polyfit(grid.gdalt[gates], grid.data[param][:, gates],
+                           grid.data[ESFGrid.ERRORS[param]][:, gates], deg,
+                           scale_cov)
+
+
+def polyfit_loop(grid, param = 'VIPE1', deg = 1):
+    """
+    The same fits as fit_profiles, one np.polyfit call per profile, for
+    comparison.
+
+    Returns:
+        A tuple of the (rows, deg + 1) coefficients and
+        (rows, deg + 1, deg + 1) covariances
+    """
+    y = np.ma.filled(grid.data[param], np.nan)
+    sigma = np.ma.filled(grid.data[ESFGrid.ERRORS[param]], np.nan)
+    coef = np.full((len(y), deg + 1), np.nan)
+    cov = np.full((len(y), deg + 1, deg + 1), np.nan)
+    for i in range(len(y)):
+        with np.errstate(invalid = 'ignore'):
+            good = np.isfinite(y[i]) & np.isfinite(sigma[i]) & (sigma[i] > 0)
+        if (good.sum() > deg):
+            coef[i], cov[i] = np.polyfit(grid.gdalt[good], y[i, good], deg,
+                                         w = 1 / sigma[i, good],
+                                         cov = 'unscaled')
+    return coef, cov
+
+
+def benchmark(filename, param = 'VIPE1', deg = 1, repeat = 3):
+    """
+    Times fit_profiles against polyfit_loop on a night, checks that they
+    agree, and prints the results.
+
+    Returns:
+        A dict of the best times in seconds
+    """
+    if (ESFReader.is_hdf5(filename)):
+        parser = ESFReader.read_hdf5_table
+    else:
+        parser = ESFReader.read_table
+    grid = ESFGrid.grid_profiles(ESFCache.cached_read(filename,
+                                                      parser = parser))
+
+    def best(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(grid, param, deg)
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    stacked, fit = best(fit_profiles)
+    loop, (coef, cov) = best(polyfit_loop)
+    both = np.isfinite(coef[:, 0])
+    scale = np.abs(coef[both]).max(axis = 0)
+    print('{} profiles, degree {}: {} fitted'.format(len(grid.ut), deg,
+                                                      both.sum()))
+    print('np.polyfit loop   {:.4f} s'.format(loop))
+    print('stacked_polyfit   {:.4f} s  ({:.0f}x faster)'.format(
+        stacked, loop / stacked))
+    print('largest coefficient difference, relative to the largest '
+          'coefficient: {:.2g}'.format(
+              (np.abs(fit.coef[both] - coef[both]) / scale).max()))
+    return {'loop': loop, 'stacked': stacked}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compare the stacked '
+                                     'drift fit with a loop over '
+                                     'np.polyfit.')
+    parser.add_argument('filename')
+    parser.add_argument('--param', default = 'VIPE1')
+    parser.add_argument('--deg', type = int, default = 1)
+    parser.add_argument('--repeat', type = int, default = 3)
+    args = parser.parse_args()
+    benchmark(args.filename, args.param, args.deg, args.repeat)
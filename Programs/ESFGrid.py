@@ -0,0 +1,104 @@
+"""
+Turns the long format ESF tables, one row per altitude gate of each profile,
+into dense (time, altitude) grids.
+
+The bundled night has 1379 profiles and up to 176 altitude gates, so each
+measured parameter is really a 1379 x 176 image. Gates that a profile did not
+measure, or that Madrigal flagged as missing, are masked rather than filled
+with zeros.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+import ESFReader
+import Instrument
+
+MEASURED = ('SNL', 'VIPE1', 'DVIPE1', 'VIPN1', 'DVIPN1')
+ERRORS = {'VIPE1': 'DVIPE1', 'VIPN1': 'DVIPN1'}
+
+Grid = namedtuple('Grid', ['ut', 'gdalt', 'data'])
+
+
+def _has_column(table, name):
+    """
+    Checks for a column in either a structured array or a dict of arrays.
+    """
+    names = getattr(getattr(table, 'dtype', None), 'names', None)
+    if (names is None):
+        names = table.keys()
+    return name in names
+
+
+def table_times(table):
+    """
+    Returns the UT time in unix seconds of every row of a table. UT1_UNIX is
+    used when the table has it (HDF5 exports), otherwise the time is worked
+    out from the YEAR to SEC columns.
+
+    Args:
+        table - A structured array or dict of arrays indexable by column name
+
+    Returns:
+        An int64 array with one time per row
+    """
+    if (_has_column(table, 'UT1_UNIX')):
+        return np.asarray(table['UT1_UNIX'], dtype = 'i8')
+    return ESFReader.unix_time(table)
+
+
+def _time_bins(ut):
+    """
+    Finds the distinct profile times and the profile each row belongs to.
+    Rows of an export are already in time order, in which case this is a
+    single linear pass rather than a sort.
+    """
+    if (len(ut) == 0):
+        return ut[:0], np.zeros(0, dtype = 'intp')
+    step = ut[1:] != ut[:-1]
+    if (np.all(ut[1:] >= ut[:-1])):
+        times = ut[np.r_[True, step]]
+        return times, np.r_[0, np.cumsum(step)]
+    return np.unique(ut, return_inverse = True)
+
+
+@Instrument.instrument
+def grid_profiles(table, params = MEASURED, ut = None):
+    """
+    Grids the measured parameters of a long format table onto a dense
+    (time, altitude) grid in one vectorized pass.
+
+    Args:
+        table  - A structured array or dict of arrays with a GDALT column, the
+                 columns in params and either UT1_UNIX or YEAR to SEC, such
+                 as the output of ESFReader.read_table or
+                 ESFReader.read_hdf5_columns
+        params - The columns to grid. SNL, VIPE1, DVIPE1, VIPN1 and DVIPN1 by
+                 default.
+        ut     - The UT time in unix seconds of every row. Worked out with
+                 table_times by default.
+
+    Returns:
+        A Grid named tuple of (ut, gdalt, data). ut holds the time of each
+        profile and gdalt the altitude of each gate, both sorted. data is a
+        dict mapping each parameter to a masked array of shape
+        (len(ut), len(gdalt)). If a gate appears twice in one profile, the
+        later row wins.
+    """
+    if (ut is None):
+        ut = table_times(table)
+    ut = np.asarray(ut, dtype = 'i8')
+    gdalt = np.asarray(table['GDALT'], dtype = 'f8')
+    good = ~np.isnan(gdalt)
+
+    times, tindex = _time_bins(ut)
+    gates, aindex = np.unique(gdalt[good], return_inverse = True)
+    tindex = tindex[good]
+    shape = (len(times), len(gates))
+
+    data = {}
+    for param in params:
+        values = np.full(shape, np.nan)
+        values[tindex, aindex] = np.asarray(table[param], dtype = 'f8')[good]
+        data[param] = np.ma.masked_invalid(values, copy = False)
+    return Grid(times, gates, data)
@@ -0,0 +1,185 @@
+"""
+A time index over the profiles of an ESF export, for answering queries such
+as "give me the profiles between 23:30 and 01:15 UT" without parsing and
+filtering the whole file.
+
+The index holds one entry per profile: its UT time in unix seconds, the row
+of its first gate and, for text exports, the byte offset of its first line.
+Queries find the matching profiles with a binary search on the times, then
+decode only the rows between them. Indexes are stored as sidecars through
+ESFCache, so they are built once and rebuilt automatically when the file
+changes.
+
+For text exports the profile time comes from the YEAR to SEC columns (the
+middle of the integration). For HDF5 exports it is the UT1_UNIX parameter
+(the start of the integration).
+"""
+import calendar
+import datetime
+import io
+
+import numpy as np
+
+import ESFCache
+import ESFReader
+
+INDEX_DTYPE = np.dtype([('UT', 'i8'), ('ROW', 'i8'), ('OFFSET', 'i8')])
+INDEX_VERSION = 1
+
+
+def build_text_index(filename):
+    """
+    Scans a text export once and records where every profile starts. Only
+    the six time fields of each line are looked at.
+
+    Args:
+        filename - The path to the text file
+
+    Returns:
+        A structured array with the dtype INDEX_DTYPE
+    """
+    entries = []
+    with open(filename, 'rb') as f:
+        offset = len(f.readline())
+        key = None
+        for row, line in enumerate(f):
+            stamp = line.split(None, 6)[:6]
+            if (stamp and stamp != key):
+                key = stamp
+                ut = calendar.timegm(tuple(int(field) for field in stamp))
+                entries.append((ut, row, offset))
+            offset += len(line)
+    return np.array(entries, dtype = INDEX_DTYPE)
+
+
+def build_hdf5_index(filename):
+    """
+    Builds the index of an HDF5 export from its UT1_UNIX column.
+
+    Args:
+        filename - The path to the HDF5 file
+
+    Returns:
+        A structured array with the dtype INDEX_DTYPE. OFFSET is -1 since
+        rows of an HDF5 dataset do not have a byte offset.
+    """
+    ut = ESFReader.read_hdf5_columns(filename, ['UT1_UNIX'])['UT1_UNIX']
+    starts = np.flatnonzero(np.r_[True, ut[1:] != ut[:-1]])
+    index = np.empty(len(starts), dtype = INDEX_DTYPE)
+    index['UT'] = ut[starts]
+    index['ROW'] = starts
+    index['OFFSET'] = -1
+    return index
+
+
+def load_index(filename, cache_dir = None):
+    """
+    Returns the index of an export, building and saving it if needed.
+
+    Args:
+        filename  - The path to a text or HDF5 export
+        cache_dir - Where to keep the index sidecar, see ESFCache.cached_read
+
+    Returns:
+        A structured array with the dtype INDEX_DTYPE, one entry per profile
+    """
+    if (ESFReader.is_hdf5(filename)):
+        builder = build_hdf5_index
+    else:
+        builder = build_text_index
+    return ESFCache.cached_read(filename, parser = builder,
+                                version = INDEX_VERSION, cache_dir = cache_dir)
+
+
+def _resolve(when, first_ut):
+    """
+    Converts a query time into unix seconds. A datetime.time is taken to be
+    on whichever day puts it within 12 hours of the first profile, so a
+    night which starts at 23:00 UT can be queried with plain clock times.
+    """
+    if (isinstance(when, datetime.datetime)):
+        return calendar.timegm(when.utctimetuple())
+    if (isinstance(when, datetime.time)):
+        seconds = when.hour * 3600 + when.minute * 60 + when.second
+        ut = first_ut - first_ut % 86400 + seconds
+        if (ut < first_ut - 43200):
+            ut += 86400
+        elif (ut >= first_ut + 43200):
+            ut -= 86400
+        return ut
+    return int(when)
+
+
+def time_range(index, start, stop):
+    """
+    Finds the profiles with start <= UT < stop.
+
+    Args:
+        index - An index returned by load_index
+        start - The start of the range in unix seconds, as a datetime or as a
+                datetime.time (see below)
+        stop  - The end of the range, in the same forms as start. When both
+                are datetime.time objects and stop is not after start, the
+                range is taken to cross midnight.
+
+    Returns:
+        A tuple (first, last) of the positions in the index of the first
+        matching profile and one past the last matching profile
+    """
+    if (len(index) == 0):
+        return 0, 0
+    first_ut = int(index['UT'][0])
+    t0 = _resolve(start, first_ut)
+    t1 = _resolve(stop, first_ut)
+    if (isinstance(stop, datetime.time) and t1 <= t0):
+        t1 += 86400
+    return (int(np.searchsorted(index['UT'], t0, 'left')),
+            int(np.searchsorted(index['UT'], t1, 'left')))
+
+
+def query_time_range(filename, start, stop, columns = None, cache_dir = None):
+    """
+    Reads only the rows of the profiles with start <= UT < stop.
+
+    For text exports the file is seeked straight to the first matching
+    profile and only the matching lines are parsed. For HDF5 exports only
+    the matching rows, and only the requested columns, are read.
+
+    Args:
+        filename  - The path to a text or HDF5 export
+        start     - The start of the range, see time_range
+        stop      - The end of the range, see time_range
+        columns   - The columns to return. All of ESFReader.COLUMNS by
+                    default.
+        cache_dir - Where to keep the index sidecar, see ESFCache.cached_read
+
+    Returns:
+        For text exports a structured array, for HDF5 exports a dict of
+        arrays. Either can be indexed by column name.
+    """
+    if (columns is None):
+        columns = ESFReader.COLUMNS
+    index = load_index(filename, cache_dir)
+    first, last = time_range(index, start, stop)
+
+    if (ESFReader.is_hdf5(filename)):
+        if (first == last):
+            rows = slice(0, 0)
+        elif (last < len(index)):
+            rows = slice(int(index['ROW'][first]), int(index['ROW'][last]))
+        else:
+            rows = slice(int(index['ROW'][first]), None)
+        return ESFReader.read_hdf5_columns(filename, columns, rows)
+
+    if (first == last):
+        table = np.empty(0, dtype = ESFReader.TABLE_DTYPE)
+    else:
+        with open(filename, 'rb') as f:
+            f.seek(int(index['OFFSET'][first]))
+            if (last < len(index)):
+                text = f.read(int(index['OFFSET'][last] -
+                                  index['OFFSET'][first]))
+            else:
+                text = f.read()
+        table = ESFReader.parse_rows(io.StringIO(text.decode('ascii')))
+    return table[list(columns)]
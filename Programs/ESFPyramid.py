@@ -0,0 +1,414 @@
+"""
+A multi-resolution pyramid of ESF time x altitude aggregates, so that an RTI
+view of anything from a month down to an hour can be drawn without going
+through the full resolution data.
+
+Level 0 holds the gridded profiles themselves and each level above combines
+2 x 2 cells of the one below, so a cell of level k covers 2**k profiles and
+2**k gates. For every parameter each level stores the count of valid values,
+their sum and their maximum, and for the drifts also sum(x / dx**2) and
+sum(1 / dx**2) for the error-weighted mean, using DVIPE1 and DVIPN1 as dx.
+All of these combine by adding (or taking the maximum), so each level is
+built from the one below, and appending a night only recomputes the last
+cell of each level.
+
+The levels are chunked, lzf compressed HDF5 datasets in esf_pyramid.hdf5
+next to the data. A query picks the finest level which has no more cells
+across the window than asked for, and reads just the chunks of that level
+which the window covers:
+
+    with Pyramid('data/esf_pyramid.hdf5') as pyramid:
+        pyramid.add_files('data')
+        view = pyramid.query(start, stop, n_time = 800)
+        rti = PlotTools.RTIPlot(ax, (view.ut_start + view.ut_stop) / 2,
+                                view.gdalt, view.data['SNL']['mean'])
+
+Run this module as a script to build or update the pyramid for a directory
+of nightly exports:
+
+    python ESFPyramid.py ../
+"""
+import argparse
+import os
+from collections import namedtuple
+
+import numpy as np
+
+import ESFBatch
+import ESFGrid
+
+PARAMS = ('SNL', 'VIPE1', 'VIPN1')
+ERRORS = ESFGrid.ERRORS
+LEVELS = 9
+TILE = (256, 32)
+FILENAME = 'esf_pyramid.hdf5'
+
+View = namedtuple('View', ['level', 'ut_start', 'ut_stop', 'gdalt', 'data'])
+
+
+def pyramid_path(directory):
+    """
+    Returns the path of the pyramid for a directory of exports.
+    """
+    return os.path.join(directory, FILENAME)
+
+
+def _level0(grid, params):
+    """
+    Turns the gridded profiles into the sums stored at level 0.
+    """
+    stats = {}
+    for param in params:
+        values = np.ma.masked_invalid(grid.data[param])
+        valid = ~np.ma.getmaskarray(values)
+        x = values.filled(0.0)
+        stats[param] = {'count': valid.astype('i4'), 'sum': x,
+                        'max': np.where(valid, x, -np.inf)}
+        if (param in ERRORS):
+            error = np.ma.masked_invalid(grid.data[ERRORS[param]])
+            error = error.filled(0.0)
+            with np.errstate(divide = 'ignore'):
+                weight = np.where(valid & (error > 0), 1 / error**2, 0.0)
+            stats[param]['wsum'] = weight * x
+            stats[param]['wnorm'] = weight
+    return stats
+
+
+def _halve(stats, axis):
+    """
+    Combines neighbouring pairs of cells along an axis, padding an odd
+    length with an empty cell.
+    """
+    combined = {}
+    for name, a in stats.items():
+        if (a.shape[axis] % 2):
+            pad = [(0, 0)] * a.ndim
+            pad[axis] = (0, 1)
+            a = np.pad(a, pad, constant_values = -np.inf if name == 'max'
+                       else 0)
+        a = a.reshape(a.shape[:axis] + (a.shape[axis] // 2, 2) +
+                      a.shape[axis + 1:])
+        if (name == 'max'):
+            combined[name] = a.max(axis = axis + 1)
+        else:
+            combined[name] = a.sum(axis = axis + 1)
+    return combined
+
+
+def _halve_times(start, stop):
+    """
+    Combines neighbouring pairs of cell time ranges.
+    """
+    n = len(start)
+    return start[0::2], stop[np.minimum(np.arange(1, n + 1, 2), n - 1)]
+
+
+def _halve_gdalt(gdalt):
+    """
+    Returns the altitudes of the gates of the next level up.
+    """
+    if (len(gdalt) % 2):
+        gdalt = np.r_[gdalt, np.nan]
+    pairs = gdalt.reshape(-1, 2)
+    return np.where(np.isnan(pairs[:, 1]), pairs[:, 0], pairs.mean(axis = 1))
+
+
+def _align(grid, gdalt):
+    """
+    Puts gridded profiles onto the gates of the pyramid, masking the gates
+    they did not measure.
+    """
+    if (np.array_equal(grid.gdalt, gdalt)):
+        return grid
+    index = np.searchsorted(gdalt, grid.gdalt).clip(0, len(gdalt) - 1)
+    if (np.any(gdalt[index] != grid.gdalt)):
+        raise ValueError('the profiles have gates which are not in the '
+                         'pyramid')
+    data = {}
+    for name, values in grid.data.items():
+        aligned = np.ma.masked_all((len(grid.ut), len(gdalt)))
+        aligned[:, index] = values
+        data[name] = aligned
+    return ESFGrid.Grid(grid.ut, gdalt, data)
+
+
+class Pyramid(object):
+    """
+    A pyramid of aggregates in an HDF5 file, created on the first append if
+    it does not exist yet.
+
+    The file is opened read only, so any number of viewers can query it
+    without write permission or the write lock. It is only reopened for
+    writing by append and add_files.
+
+    Args:
+        filename - The pyramid file, usually pyramid_path(data directory)
+        params   - The parameters to aggregate. Only used when the file is
+                   created.
+        levels   - The number of levels, including level 0. Only used when
+                   the file is created.
+        tile     - The (time, altitude) chunk shape of the datasets
+    """
+    def __init__(self, filename, params = PARAMS, levels = LEVELS,
+                 tile = TILE):
+        import h5py
+
+        self.filename = filename
+        self.tile = tile
+        self.writable = False
+        self.file = None
+        attrs = {}
+        if (os.path.exists(filename)):
+            self.file = h5py.File(filename, 'r')
+            attrs = self.file.attrs
+        if ('params' in attrs):
+            params = [p.decode() for p in attrs['params']]
+        self.params = tuple(params)
+        self.levels = int(attrs.get('levels', levels))
+        self._times = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        if (self.file is None or 'level0' not in self.file):
+            return 0
+        return len(self.file['level0/ut_start'])
+
+    def _open_for_writing(self):
+        """
+        Reopens the file for appending, creating it if need be.
+        """
+        import h5py
+
+        if (not self.writable):
+            if (self.file):
+                self.file.close()
+            self.file = h5py.File(self.filename, 'a')
+            self.writable = True
+            self._times = {}
+
+    def _create(self, gdalt):
+        """
+        Lays out the empty levels for profiles with the given gates.
+        """
+        import h5py
+
+        self.file.attrs['params'] = np.array(self.params, dtype = 'S')
+        self.file.attrs['levels'] = self.levels
+        self.file.create_dataset('sources', shape = (0,), maxshape = (None,),
+                                 dtype = h5py.string_dtype())
+        gdalt = np.asarray(gdalt, dtype = 'f8')
+        for k in range(self.levels):
+            group = self.file.create_group('level{}'.format(k))
+            group.create_dataset('gdalt', data = gdalt)
+            for name in ('ut_start', 'ut_stop'):
+                group.create_dataset(name, shape = (0,), maxshape = (None,),
+                                     dtype = 'i8', chunks = (4096,))
+            chunks = (self.tile[0], min(self.tile[1], len(gdalt)))
+            for param in self.params:
+                stats = ['count', 'sum', 'max']
+                if (param in ERRORS):
+                    stats += ['wsum', 'wnorm']
+                for stat in stats:
+                    group.create_dataset(
+                        '{}/{}'.format(param, stat), shape = (0, len(gdalt)),
+                        maxshape = (None, len(gdalt)), chunks = chunks,
+                        compression = 'lzf', shuffle = True,
+                        dtype = 'i4' if stat == 'count' else 'f4')
+            gdalt = _halve_gdalt(gdalt)
+
+    def _write(self, group, first, start, stop, stats):
+        """
+        Writes rows from first onwards of one level.
+        """
+        end = first + len(start)
+        for name, values in (('ut_start', start), ('ut_stop', stop)):
+            group[name].resize((end,))
+            group[name][first:end] = values
+        for param in self.params:
+            for stat, values in stats[param].items():
+                dset = group[param][stat]
+                dset.resize((end, dset.shape[1]))
+                dset[first:end] = values
+
+    def _read(self, group, first, end):
+        """
+        Reads rows first to end of one level.
+        """
+        stats = dict((param, dict((stat, group[param][stat][first:end])
+                                  for stat in group[param]))
+                     for param in self.params)
+        return (group['ut_start'][first:end], group['ut_stop'][first:end],
+                stats)
+
+    def append(self, grid):
+        """
+        Adds gridded profiles which are all later than those already in the
+        pyramid, and updates every level.
+
+        Args:
+            grid - An ESFGrid.Grid with the parameters and their errors, such
+                   as from ESFGrid.grid_profiles with the default params. Its
+                   gates must all be gates of the pyramid, which are those of
+                   the first grid appended.
+
+        Returns:
+            Nothing
+        """
+        self._open_for_writing()
+        if ('level0' not in self.file):
+            self._create(grid.gdalt)
+        level0 = self.file['level0']
+        grid = _align(grid, level0['gdalt'][:])
+        first = len(level0['ut_start'])
+        if (first and grid.ut[0] <= level0['ut_stop'][first - 1]):
+            raise ValueError('only profiles later than those already in the '
+                             'pyramid can be appended')
+
+        start = stop = np.asarray(grid.ut, dtype = 'i8')
+        stats = _level0(grid, self.params)
+        for k in range(self.levels):
+            group = self.file['level{}'.format(k)]
+            self._write(group, first, start, stop, stats)
+            if (k + 1 == self.levels):
+                break
+            # The first cell of the next level to recompute may pair a row
+            # already on disk with the first new row
+            up = first // 2
+            if (2 * up < first):
+                old_start, old_stop, old = self._read(group, 2 * up, first)
+                start = np.r_[old_start, start]
+                stop = np.r_[old_stop, stop]
+                stats = dict((param, dict(
+                    (stat, np.concatenate([old[param][stat], values]))
+                    for stat, values in stats[param].items()))
+                    for param in self.params)
+            start, stop = _halve_times(start, stop)
+            stats = dict((param, _halve(_halve(stats[param], 0), 1))
+                         for param in self.params)
+            first = up
+        self._times = {}
+
+    def add_files(self, source):
+        """
+        Appends the exports which have not been added yet, in time order.
+        Each night is only added once, whether as text or HDF5.
+
+        Args:
+            source - A directory, a glob pattern or a list of paths, as for
+                     ESFBatch.find_files
+
+        Returns:
+            The list of files that were added
+        """
+        self._open_for_writing()
+        added = []
+        for filename in ESFBatch.find_files(source):
+            # The text and HDF5 exports of a night share a name, and only
+            # one of them is added
+            name = os.path.splitext(os.path.basename(filename))[0]
+            if ('sources' in self.file and
+                    name in self.file['sources'].asstr()[:]):
+                continue
+            table = ESFBatch.read_file(filename)
+            self.append(ESFGrid.grid_profiles(table))
+            sources = self.file['sources']
+            sources.resize((len(sources) + 1,))
+            sources[-1] = name
+            added.append(filename)
+        return added
+
+    def _level_times(self, k):
+        """
+        Returns the cached (ut_start, ut_stop) arrays of level k.
+        """
+        if (k not in self._times):
+            group = self.file['level{}'.format(k)]
+            self._times[k] = (group['ut_start'][:], group['ut_stop'][:])
+        return self._times[k]
+
+    def query(self, start, stop, n_time = 1000, low = None, high = None,
+              params = None):
+        """
+        Reads the aggregates covering a time and altitude window.
+
+        Args:
+            start  - The start of the window in unix seconds
+            stop   - The end of the window in unix seconds
+            n_time - The most cells wanted across the time window, usually
+                     the width of the axes in pixels
+            low    - The lowest altitude wanted in km. All gates by default.
+            high   - The highest altitude wanted in km
+            params - The parameters to read. All of them by default.
+
+        Returns:
+            A View of the level used, the time range of each cell, the gate
+            altitudes and, for each parameter, a dict of 'count', 'mean' and
+            'max' arrays, plus 'wmean' for the drifts. The arrays are shaped
+            (cells, gates) and are masked where there is no data.
+        """
+        if (not len(self)):
+            raise ValueError('{} has no profiles'.format(self.filename))
+        params = self.params if params is None else params
+        for k in range(self.levels):
+            cell_start, cell_stop = self._level_times(k)
+            i0 = int(np.searchsorted(cell_stop, start, 'left'))
+            i1 = int(np.searchsorted(cell_start, stop, 'left'))
+            if (i1 - i0 <= n_time):
+                break
+        group = self.file['level{}'.format(k)]
+        gdalt = group['gdalt'][:]
+        keep = np.isfinite(gdalt)
+        if (low is not None):
+            keep &= gdalt >= low
+        if (high is not None):
+            keep &= gdalt <= high
+        gates = np.flatnonzero(keep)
+        a0, a1 = (gates[0], gates[-1] + 1) if len(gates) else (0, 0)
+
+        data = {}
+        for param in params:
+            stats = dict((stat, group[param][stat][i0:i1, a0:a1])
+                         for stat in group[param])
+            empty = stats['count'] == 0
+            count = np.where(empty, 1, stats['count'])
+            data[param] = {
+                'count': stats['count'],
+                'mean': np.ma.masked_where(empty, stats['sum'] / count),
+                'max': np.ma.masked_where(empty, stats['max'])}
+            if ('wsum' in stats):
+                unweighted = stats['wnorm'] == 0
+                wnorm = np.where(unweighted, 1, stats['wnorm'])
+                data[param]['wmean'] = np.ma.masked_where(
+                    unweighted, stats['wsum'] / wnorm)
+        return View(k, cell_start[i0:i1], cell_stop[i0:i1], gdalt[a0:a1],
+                    data)
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        if (self.file):
+            self.file.close()
+            self.file = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Build or update the '
+                                     'aggregate pyramid for a directory of '
+                                     'ESF exports.')
+    parser.add_argument('directory')
+    parser.add_argument('--levels', type = int, default = LEVELS)
+    args = parser.parse_args()
+    with Pyramid(pyramid_path(args.directory),
+                 levels = args.levels) as pyramid:
+        for filename in pyramid.add_files(args.directory):
+            print('Added', filename)
+        for k in range(pyramid.levels):
+            print('Level {}: {} x {} cells'.format(
+                k, len(pyramid.file['level{}/ut_start'.format(k)]),
+                len(pyramid.file['level{}/gdalt'.format(k)])))
@@ -0,0 +1,509 @@
+"""
+Readers for the Madrigal ESF radar exports that accompany the Input/Output
+part of the meeting, jul20140820_esf.001.txt and jul20140820_esf.001.hdf5.
+
+Each line of the text export is one altitude gate of one radar profile. All
+the gates of a profile share the same YEAR, MONTH, DAY, HOUR, MIN and SEC
+values, so a profile is just a run of consecutive lines with one timestamp.
+The HDF5 export holds the same records, plus UT1_UNIX, UT2_UNIX and RECNO,
+as a single compound dataset under Data/Table Layout.
+
+The text export is laid out in fixed width columns, every line the same
+length. read_fixed_width uses this to decode the whole file with numpy,
+without splitting it into lines or fields in Python.
+
+h5py is only needed for the HDF5 readers and is imported when they are used.
+"""
+import calendar
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+import Instrument
+
+COLUMNS = ('YEAR', 'MONTH', 'DAY', 'HOUR', 'MIN', 'SEC', 'GDLATR', 'GDLONR',
+           'GDALT', 'SNL', 'VIPE1', 'DVIPE1', 'VIPN1', 'DVIPN1')
+TIME_COLUMNS = ('YEAR', 'MONTH', 'DAY', 'HOUR', 'MIN', 'SEC')
+PROFILE_COLUMNS = ('GDALT', 'SNL', 'VIPE1', 'DVIPE1', 'VIPN1', 'DVIPN1')
+HDF5_TABLE = 'Data/Table Layout'
+HDF5_EXTENSIONS = ('.hdf5', '.h5')
+TABLE_DTYPE = np.dtype([(name, 'i8') for name in TIME_COLUMNS] +
+                       [(name, 'f8') for name in COLUMNS[6:]])
+
+# Bump whenever read_table changes what it returns, so cached copies of its
+# output (see ESFCache.py) are rebuilt.
+PARSER_VERSION = 1
+
+Profile = namedtuple('Profile', ['ut', 'data'])
+
+# read_fixed_width decodes this many lines at a time, so the arrays it works
+# on stay small
+FIXED_WIDTH_ROWS = 4096
+_MINUS, _NEWLINE, _CR = b'-\n\r'
+# The kinds of byte a fixed width number is made of, as bit flags
+_DIGIT, _BLANK, _SIGN, _POINT, _EXP, _EOL, _OTHER = (1, 2, 4, 8, 16, 32, 64)
+_ANY = 127
+_KIND = np.full(256, _OTHER, dtype = 'u1')
+_KIND[np.frombuffer(b'0123456789', dtype = 'u1')] = _DIGIT
+_KIND[np.frombuffer(b' ', dtype = 'u1')] = _BLANK
+_KIND[np.frombuffer(b'+-', dtype = 'u1')] = _SIGN
+_KIND[np.frombuffer(b'.', dtype = 'u1')] = _POINT
+_KIND[np.frombuffer(b'eE', dtype = 'u1')] = _EXP
+_KIND[np.frombuffer(b'\r\n', dtype = 'u1')] = _EOL
+# Powers of ten up to 10**22 are exact as floats, so multiplying or dividing
+# by one rounds only once and gives the same float as float() does
+_POW10 = 10.0 ** np.arange(23)
+
+
+def _to_float(field):
+    """
+    Converts a single text field to a float. Madrigal writes flags such as
+    'missing' or 'knownbad' in place of a number, these become nan.
+    """
+    try:
+        return float(field)
+    except ValueError:
+        return np.nan
+
+
+def _make_profile(key, rows, dtype):
+    """
+    Builds a Profile from the timestamp fields and the accumulated rows.
+    """
+    ut = calendar.timegm(tuple(int(_to_float(k)) for k in key))
+    return Profile(ut, np.array(rows, dtype = dtype))
+
+
+def read_profiles(filename, columns = PROFILE_COLUMNS):
+    """
+    Generator which reads a Madrigal text export one radar profile at a time.
+    Lines are consumed lazily, so only a single profile is ever held in
+    memory and the first profile is available before the rest of the file
+    has been read.
+
+    Args:
+        filename - The path to the text file, e.g. jul20140820_esf.001.txt
+        columns  - The names of the columns to return for every gate. By
+                   default GDALT, SNL, VIPE1, DVIPE1, VIPN1 and DVIPN1.
+
+    Yields:
+        A Profile named tuple of (ut, data), where ut is the UT time of the
+        profile in unix seconds and data is a structured array with one
+        float64 field per requested column and one row per altitude gate.
+    """
+    dtype = np.dtype([(name, 'f8') for name in columns])
+    with open(filename, 'rb') as f:
+        header = f.readline().decode('ascii').upper().split()
+        try:
+            index = [header.index(name) for name in columns]
+            tindex = [header.index(name) for name in TIME_COLUMNS]
+        except ValueError as err:
+            raise ValueError('{} is missing a column: {}'.format(filename, err))
+        key, rows = None, []
+        for line in f:
+            fields = line.split()
+            if (not fields):
+                continue
+            stamp = tuple(fields[i] for i in tindex)
+            if (stamp != key):
+                if (rows):
+                    yield _make_profile(key, rows, dtype)
+                key, rows = stamp, []
+            rows.append(tuple(_to_float(fields[i]) for i in index))
+        if (rows):
+            yield _make_profile(key, rows, dtype)
+
+
+@Instrument.instrument
+def parse_rows(lines):
+    """
+    Parses data lines of a Madrigal text export, without the header line.
+
+    Args:
+        lines - An iterable of text lines, such as an open file positioned
+                after the header
+
+    Returns:
+        A structured array with the dtype TABLE_DTYPE and one row per line
+    """
+    converters = dict((i, _to_float) for i in range(6, len(COLUMNS)))
+    return np.loadtxt(lines, dtype = TABLE_DTYPE, converters = converters,
+                      ndmin = 1)
+
+
+@Instrument.instrument
+def read_table(filename):
+    """
+    Reads a whole Madrigal text export into memory in one go.
+
+    Args:
+        filename - The path to the text file, e.g. jul20140820_esf.001.txt
+
+    Returns:
+        A structured array with the dtype TABLE_DTYPE and one row per line
+    """
+    with open(filename, 'r') as f:
+        header = f.readline().upper().split()
+        if (tuple(header) != COLUMNS):
+            raise ValueError('{} does not have the columns {}'.format(
+                filename, ' '.join(COLUMNS)))
+        return parse_rows(f)
+
+
+def _layout(block):
+    """
+    Finds how the numbers of a fixed width field are laid out, from a sample
+    of its rows.
+
+    Args:
+        block - A (rows, width) uint8 array of the bytes of the field
+
+    Returns:
+        A tuple (first, end, dot, exp) of the first position any number
+        starts at, and the most common positions of the last character, the
+        decimal point and the e of the exponent, with -1 for no decimal
+        point or exponent. None if there is no number in the sample, or the
+        numbers cannot be decoded exactly (more than 15 digits).
+    """
+    kind = _KIND[block]
+    numbers = (((kind & (_DIGIT | _BLANK | _SIGN | _POINT | _EXP)) != 0)
+               .all(axis = 1) & (kind & _DIGIT != 0).any(axis = 1))
+    kind = kind[numbers]
+    if (not len(kind)):
+        return None
+    width = kind.shape[1]
+    blank = kind == _BLANK
+    first = int(np.argmax(~blank, axis = 1).min())
+    end = width - 1 - np.argmax(~blank[:, ::-1], axis = 1)
+    dots = kind == _POINT
+    dot = np.where(dots.any(axis = 1), np.argmax(dots, axis = 1), -1)
+    exps = kind == _EXP
+    exp = np.where(exps.any(axis = 1), np.argmax(exps, axis = 1), -1)
+    key = (end * width + dot + 1) * width + exp + 1
+    values, counts = np.unique(key, return_counts = True)
+    key = int(values[np.argmax(counts)])
+    end, dot, exp = key // width**2, key // width % width - 1, key % width - 1
+    stop = exp if exp >= 0 else end + 1
+    point = dot if dot >= 0 else stop
+    n_frac = stop - point - 1 if dot >= 0 else 0
+    if (first >= point and n_frac == 0 or point - first + n_frac > 15 or
+            exp >= 0 and exp >= end or first > point):
+        return None
+    return first, end, dot, exp
+
+
+def _horner(digits, places):
+    """
+    Returns the integers made of the digits at some positions of each row,
+    the most significant first, with Horner's rule. Positions holding
+    something other than a digit must be 0 in digits.
+    """
+    number = digits[:, places[0]].astype('i8')
+    for p in places[1:]:
+        number *= 10
+        number += digits[:, p]
+    return number
+
+
+class _Plan(object):
+    """
+    What every byte of a line of a fixed width file may be, and where the
+    digits and signs of each column are.
+
+    Args:
+        width    - The length of a line, including its end of line
+        line_end - Where the end of line starts
+        ranges   - A list of the (start, stop) byte range of each column to
+                   decode
+        layouts  - The layout of each column from _layout, relative to its
+                   start, or None to convert every field of the column
+                   without decoding it
+    """
+    def __init__(self, width, line_end, ranges, layouts):
+        n = len(ranges)
+        # Which column each byte belongs to
+        self.columns = np.zeros((width, n), dtype = 'f4')
+        self.allow = np.full(width, _ANY, dtype = 'u1')
+        self.allow[line_end:] = _EOL
+        # Positions in the integer part after its first, where a blank or
+        # sign must not follow anything but a blank
+        self.lead = np.zeros(width, dtype = bool)
+        self.decoded = np.zeros(n, dtype = bool)
+        # For each decoded column: its index, the positions of the digits of
+        # its mantissa, where a minus sign of the mantissa may be, the
+        # number of decimals, and the positions of the digits of the
+        # exponent, the first of which may be its sign
+        self.fields = []
+        for i, ((start, stop), layout) in enumerate(zip(ranges, layouts)):
+            self.columns[start:stop, i] = 1
+            if (layout is None):
+                continue
+            self.decoded[i] = True
+            first, end, dot, exp = (start + p if p >= 0 else -1
+                                    for p in layout)
+            mantissa_end = exp if exp >= 0 else end + 1
+            point = dot if dot >= 0 else mantissa_end
+            n_frac = mantissa_end - point - 1 if dot >= 0 else 0
+            allow = self.allow
+            allow[start:stop] = _BLANK
+            allow[first:point] = _DIGIT | _BLANK | _SIGN
+            self.lead[first + 1:point] = True
+            if (n_frac == 0):
+                allow[point - 1] = _DIGIT
+            places = list(range(first, point))
+            if (dot >= 0):
+                allow[dot] = _POINT
+                allow[dot + 1:mantissa_end] = _DIGIT
+                places += range(dot + 1, mantissa_end)
+            exp_places = None
+            if (exp >= 0):
+                allow[exp] = _EXP
+                allow[exp + 1] = _DIGIT | _SIGN
+                allow[exp + 2:end + 1] = _DIGIT
+                exp_places = list(range(exp + 1, end + 1))
+            self.fields.append((i, places, slice(first, point), n_frac,
+                                exp_places))
+
+    def decode(self, lines):
+        """
+        Decodes a block of lines.
+
+        Args:
+            lines - A (rows, width) uint8 array
+
+        Returns:
+            A tuple of the (rows, columns) float64 values and a
+            (rows, columns) bool array, True where a field did not match the
+            layout of its column and its value is meaningless
+        """
+        kind = np.take(_KIND, lines)
+        bad = (kind & self.allow) == 0
+        blank = kind == _BLANK
+        bad[:, 1:] |= (((kind[:, 1:] & (_BLANK | _SIGN)) != 0) &
+                       ~blank[:, :-1] & self.lead[1:])
+        digits = lines - np.uint8(ord('0'))
+        digits *= digits <= 9
+        minus = lines == _MINUS
+
+        # Each column is decoded on its own, so every step works on
+        # contiguous vectors. The integers are exact, and scaling them by an
+        # exact power of ten rounds once, as float() does.
+        value = np.zeros((len(lines), len(self.decoded)))
+        odd = np.zeros(value.shape, dtype = bool)
+        odd[:, ~self.decoded] = True
+        for i, places, lead, n_frac, exp_places in self.fields:
+            number = _horner(digits, places).astype('f8')
+            np.negative(number, out = number,
+                        where = minus[:, lead].any(axis = 1))
+            if (exp_places is not None):
+                power = _horner(digits, exp_places)
+                np.negative(power, out = power,
+                            where = minus[:, exp_places[0]])
+                power -= n_frac
+                odd[:, i] = np.abs(power) >= len(_POW10)
+                scale = _POW10[np.minimum(np.abs(power), len(_POW10) - 1)]
+                number = np.where(power >= 0, number * scale, number / scale)
+            elif (n_frac):
+                number /= _POW10[n_frac]
+            value[:, i] = number
+
+        rows = np.flatnonzero(bad.any(axis = 1))
+        if (len(rows)):
+            odd[rows] |= (bad[rows].view('u1').astype('f4') @
+                          self.columns) > 0
+        return value, odd
+
+
+def _convert_odd(block, convert):
+    """
+    Converts fields which are not plain numbers, such as Madrigal's
+    'missing' flag, once for each distinct text.
+
+    Args:
+        block   - A (rows, width) uint8 array of the bytes of the fields
+        convert - Converts the text of a field, e.g. _to_float
+
+    Returns:
+        A float64 array with one value per row
+    """
+    fields = np.ascontiguousarray(block).view(
+        'V{}'.format(block.shape[1])).ravel()
+    texts, inverse = np.unique(fields, return_inverse = True)
+    converted = np.array([convert(bytes(text).decode('latin-1').strip())
+                          for text in texts], dtype = 'f8')
+    return converted[inverse.ravel()]
+
+
+@Instrument.instrument
+def read_fixed_width(filename, columns = COLUMNS):
+    """
+    Reads a Madrigal text export by memory mapping it and decoding all its
+    lines at once with numpy, FIXED_WIDTH_ROWS at a time.
+
+    The byte range of each column runs from the start of its name in the
+    header line to the start of the next name. How the numbers of each
+    column are laid out is taken from the first lines, and every line is
+    checked against it, byte by byte. Fields which differ, such as
+    'missing', are converted the same way read_table converts them. A file
+    whose lines are not all the same length is read with read_table
+    instead.
+
+    Args:
+        filename - The path to the text file, e.g. jul20140820_esf.001.txt
+        columns  - The names of the columns to decode. All of them by
+                   default, and the other columns are not decoded at all.
+
+    Returns:
+        A structured array with the requested fields of TABLE_DTYPE, in
+        the same order, and one row per line. With the default columns it
+        is identical to what read_table returns.
+    """
+    columns = [name.upper() for name in columns]
+    dtype = np.dtype([(name, TABLE_DTYPE[name]) for name in columns])
+    data = np.memmap(filename, dtype = 'u1', mode = 'r')
+    head = bytes(data[:65536])
+    header_end = head.find(b'\n') + 1
+    width = head.find(b'\n', header_end) + 1 - header_end
+    if (header_end == 0 or width <= 0):
+        return read_table(filename)[columns]
+    starts = dict((match.group().decode('ascii'), match.start())
+                  for match in re.finditer(rb'\S+', head[:header_end].upper()))
+    missing = [name for name in columns if name not in starts]
+    if (missing):
+        raise ValueError('{} is missing a column: {}'.format(
+            filename, ' '.join(missing)))
+
+    body = data[header_end:]
+    n_rows = len(body) // width
+    lines = body[:n_rows * width].reshape(n_rows, width)
+    if (len(body) % width or not (lines[:, -1] == _NEWLINE).all() or
+            np.count_nonzero(body == _NEWLINE) != n_rows):
+        return read_table(filename)[columns]
+    line_end = width - 1 - int(lines[0, -2] == _CR) if n_rows else width - 1
+    # A column ends where the next one in the header starts, and the first
+    # column also takes anything before it
+    edges = sorted(starts.values())
+    ranges = []
+    for name in columns:
+        later = [edge for edge in edges if edge > starts[name]]
+        ranges.append((0 if starts[name] == edges[0] else starts[name],
+                       min(later + [line_end])))
+    sample = lines[:1000]
+    plan = _Plan(width, line_end, ranges,
+                 [_layout(sample[:, start:stop]) for start, stop in ranges])
+
+    table = np.empty(n_rows, dtype = dtype)
+    for start in range(0, n_rows, FIXED_WIDTH_ROWS):
+        chunk = lines[start:start + FIXED_WIDTH_ROWS]
+        value, odd = plan.decode(chunk)
+        for i, name in enumerate(columns):
+            if (odd[:, i].any()):
+                convert = int if dtype[name].kind == 'i' else _to_float
+                value[odd[:, i], i] = _convert_odd(
+                    chunk[odd[:, i], slice(*ranges[i])], convert)
+            table[name][start:start + len(chunk)] = value[:, i]
+    return table
+
+
+def unix_time(table):
+    """
+    Converts the YEAR, MONTH, DAY, HOUR, MIN and SEC columns of a table into
+    UT unix seconds without looping over the rows.
+
+    Args:
+        table - Anything indexable by column name, such as the structured
+                array returned by read_table
+
+    Returns:
+        An int64 array of unix seconds, one per row
+    """
+    year = np.asarray(table['YEAR'], dtype = 'i8')
+    days = (year - 1970).astype('datetime64[Y]').astype('datetime64[M]')
+    days = days + (np.asarray(table['MONTH'], dtype = 'i8') - 1)
+    days = days.astype('datetime64[D]') + (np.asarray(table['DAY'],
+                                                      dtype = 'i8') - 1)
+    seconds = (np.asarray(table['HOUR'], dtype = 'i8') * 3600 +
+               np.asarray(table['MIN'], dtype = 'i8') * 60 +
+               np.asarray(table['SEC'], dtype = 'i8'))
+    return days.astype('datetime64[s]').astype('i8') + seconds
+
+
+def is_hdf5(filename):
+    """
+    Tells HDF5 exports apart from text exports by their extension.
+    """
+    return os.path.splitext(filename)[1].lower() in HDF5_EXTENSIONS
+
+
+def _field_names(dset, columns):
+    """
+    Maps Madrigal mnemonics, in any case, onto the field names of a compound
+    HDF5 dataset.
+    """
+    fields = dict((name.upper(), name) for name in dset.dtype.names)
+    try:
+        return [fields[name.upper()] for name in columns]
+    except KeyError as err:
+        raise KeyError('{} has no column {}'.format(dset.name, err))
+
+
+@Instrument.instrument
+def read_hdf5_columns(filename, columns, rows = slice(None)):
+    """
+    Reads only the requested columns of the Data/Table Layout dataset for a
+    range of rows, without decoding the full record array.
+
+    If the dataset is stored contiguously and uncompressed, the file is
+    memory mapped and the returned arrays are views into the map, so nothing
+    is read from disk until the values are used. Otherwise (Madrigal files
+    are normally gzip compressed and chunked) only the requested fields are
+    converted by HDF5 into a compact record array, and the returned arrays
+    are views of its fields.
+
+    The file is opened in SWMR read mode, so files that an
+    ESFWriter.ProfileWriter is still writing can be read too.
+
+    Args:
+        filename - The path to the HDF5 file, e.g. jul20140820_esf.001.hdf5
+        columns  - A list of Madrigal mnemonics such as ['GDALT', 'SNL'].
+                   Case does not matter.
+        rows     - A slice selecting the rows to read. All rows by default.
+
+    Returns:
+        A dict mapping each requested mnemonic, in upper case, to a 1D array
+    """
+    import h5py
+
+    with h5py.File(filename, 'r', swmr = True) as f:
+        dset = f[HDF5_TABLE]
+        names = _field_names(dset, columns)
+        offset = dset.id.get_offset()
+        if (offset is not None and dset.chunks is None and
+                dset.compression is None):
+            table = np.memmap(filename, dtype = dset.dtype, mode = 'r',
+                              offset = offset, shape = dset.shape)[rows]
+        else:
+            table = dset.fields(names)[rows]
+    return dict((column.upper(), table[name])
+                for column, name in zip(columns, names))
+
+
+@Instrument.instrument
+def read_hdf5_table(filename):
+    """
+    Reads the columns that the text export also has from an HDF5 export,
+    so that text and HDF5 files can be used interchangeably.
+
+    Args:
+        filename - The path to the HDF5 file, e.g. jul20140820_esf.001.hdf5
+
+    Returns:
+        A structured array with the dtype TABLE_DTYPE and one row per record
+    """
+    columns = read_hdf5_columns(filename, COLUMNS)
+    table = np.empty(len(columns['YEAR']), dtype = TABLE_DTYPE)
+    for name in COLUMNS:
+        table[name] = columns[name]
+    return table
@@ -0,0 +1,593 @@
+"""
+Streaming statistics of the ESF drifts per altitude gate.
+
+GateStats keeps the inverse-variance weighted mean and variance of VIPE1 or
+VIPN1 at every GDALT gate, using DVIPE1 or DVIPN1 as the error, without ever
+holding more than one profile (or one chunk of profiles) in memory. It only
+stores a handful of numbers per gate, so a season costs the same memory as a
+night.
+
+Updates use the pairwise formulas of Chan, Golub and LeVeque: a chunk is
+reduced to its weight, mean and sum of squared deviations in two passes, and
+then merged into the running totals with
+
+    delta = mean_b - mean_a
+    mean  = mean_a + delta * W_b / (W_a + W_b)
+    M2    = M2_a + M2_b + delta**2 * W_a * W_b / (W_a + W_b)
+
+which does not lose precision the way summing x and x**2 does. A single
+profile is just a chunk of one, which makes this Welford's update. The same
+merge combines two GateStats, so files can be reduced in parallel and the
+results added together:
+
+    stats = accumulate_files('data', processes = 4)
+    stats['VIPE1'].mean, stats['VIPE1'].error
+
+Run this module as a script to check that accumulating a directory counts
+each night once, whether it has the text export, the HDF5 export or both:
+
+    python ESFStats.py
+
+RollingWindow and rolling give the count, mean, variance and median over
+trailing 15, 30 and 60 minute windows of UT, at every profile and gate.
+"""
+import argparse
+import collections
+import heapq
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+import ESFBatch
+import ESFGrid
+import ESFReader
+
+DRIFTS = ('VIPE1', 'VIPN1')
+# HDF5 exports are read this many rows at a time
+HDF5_ROWS = 65536
+
+
+class GateStats(object):
+    """
+    Running inverse-variance weighted statistics of one parameter per gate.
+
+    Args:
+        gdalt - The gate altitudes to start with. Gates seen in later updates
+                are added as they appear.
+
+    Attributes:
+        gdalt  - The sorted gate altitudes
+        count  - The number of values used at each gate
+        weight - The sum of the weights 1 / sigma**2 at each gate
+        mean   - The weighted mean at each gate, nan where there is no data
+        m2     - The weighted sum of squared deviations from the mean
+    """
+    def __init__(self, gdalt = ()):
+        self.gdalt = np.unique(np.asarray(gdalt, dtype = 'f8'))
+        n = len(self.gdalt)
+        self.count = np.zeros(n, dtype = 'i8')
+        self.weight = np.zeros(n)
+        self.weight2 = np.zeros(n)
+        self._mean = np.zeros(n)
+        self.m2 = np.zeros(n)
+
+    def _gates(self, gdalt):
+        """
+        Returns the index of each altitude in self.gdalt, first adding any
+        altitudes which are new.
+        """
+        if (len(self.gdalt)):
+            index = np.searchsorted(self.gdalt, gdalt)
+            index = index.clip(0, len(self.gdalt) - 1)
+            if (np.array_equal(self.gdalt[index], gdalt)):
+                return index
+        gates = np.union1d(self.gdalt, gdalt)
+        old = np.searchsorted(gates, self.gdalt)
+        for name in ('count', 'weight', 'weight2', '_mean', 'm2'):
+            values = getattr(self, name)
+            grown = np.zeros(len(gates), dtype = values.dtype)
+            grown[old] = values
+            setattr(self, name, grown)
+        self.gdalt = gates
+        return np.searchsorted(gates, gdalt)
+
+    def _merge(self, index, count, weight, weight2, mean, m2):
+        """
+        Merges the statistics of a chunk into the gates at index.
+        """
+        total = self.weight[index] + weight
+        has = total > 0
+        index, total = index[has], total[has]
+        count, weight, weight2 = count[has], weight[has], weight2[has]
+        mean, m2 = mean[has], m2[has]
+        delta = mean - self._mean[index]
+        self._mean[index] += delta * weight / total
+        self.m2[index] += m2 + delta**2 * self.weight[index] * weight / total
+        self.weight[index] = total
+        self.weight2[index] += weight2
+        self.count[index] += count
+
+    def update(self, values, sigma, gdalt):
+        """
+        Adds one profile, or a chunk of profiles.
+
+        Args:
+            values - The values, shape (gates,) or (profiles, gates). Masked
+                     and nan values are skipped.
+            sigma  - The errors of the values, the same shape. Values with a
+                     masked, nan, zero or negative error are skipped.
+            gdalt  - The altitude of each gate, shape (gates,). Each altitude
+                     must appear only once.
+
+        Returns:
+            self
+        """
+        values = np.ma.filled(np.ma.asarray(values, dtype = 'f8'), np.nan)
+        sigma = np.ma.filled(np.ma.asarray(sigma, dtype = 'f8'), np.nan)
+        values, sigma = np.atleast_2d(values), np.atleast_2d(sigma)
+        with np.errstate(invalid = 'ignore'):
+            good = np.isfinite(values) & np.isfinite(sigma) & (sigma > 0)
+        w = np.zeros(values.shape)
+        w[good] = 1 / sigma[good]**2
+        x = np.where(good, values, 0.0)
+        weight = w.sum(axis = 0)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mean = (w * x).sum(axis = 0) / weight
+        mean[weight == 0] = 0
+        m2 = (w * (x - mean)**2).sum(axis = 0)
+        self._merge(self._gates(np.asarray(gdalt, dtype = 'f8')),
+                    good.sum(axis = 0), weight, (w**2).sum(axis = 0), mean,
+                    m2)
+        return self
+
+    def update_grid(self, grid, param = 'VIPE1'):
+        """
+        Adds every profile of an ESFGrid.Grid holding param and its error.
+
+        Returns:
+            self
+        """
+        return self.update(grid.data[param], grid.data[ESFGrid.ERRORS[param]],
+                           grid.gdalt)
+
+    def merge(self, other):
+        """
+        Adds the statistics of another GateStats, as if all of its updates
+        had been made to this one.
+
+        Returns:
+            self
+        """
+        self._merge(self._gates(other.gdalt), other.count, other.weight,
+                    other.weight2, other._mean, other.m2)
+        return self
+
+    __iadd__ = merge
+
+    @property
+    def mean(self):
+        """
+        The inverse-variance weighted mean at each gate.
+        """
+        return np.where(self.weight > 0, self._mean, np.nan)
+
+    @property
+    def error(self):
+        """
+        The standard error of the weighted mean at each gate,
+        1 / sqrt(sum of weights).
+        """
+        with np.errstate(divide = 'ignore'):
+            return np.where(self.weight > 0, 1 / np.sqrt(self.weight), np.nan)
+
+    @property
+    def variance(self):
+        """
+        The weighted variance of the values at each gate, with the unbiased
+        correction for reliability weights, M2 / (W - sum(w**2) / W). nan
+        where there are fewer than two values.
+        """
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            norm = self.weight - self.weight2 / self.weight
+            return np.where(self.count > 1, self.m2 / norm, np.nan)
+
+
+def accumulate_file(filename, params = DRIFTS, rows = HDF5_ROWS):
+    """
+    Streams a text or HDF5 export into a GateStats per parameter, so memory
+    does not grow with the length of the file. Text exports are read one
+    profile at a time with ESFReader.read_profiles, and HDF5 exports
+    rows at a time, cut where a profile ends.
+
+    Args:
+        filename - The path to the export
+        params   - The drift parameters to accumulate
+        rows     - How many rows of an HDF5 export to read at a time. More
+                   are read if a single profile is longer.
+
+    Returns:
+        A dict of parameter: GateStats
+    """
+    stats = dict((param, GateStats()) for param in params)
+    if (ESFReader.is_hdf5(filename)):
+        columns = tuple(params) + tuple(ESFGrid.ERRORS[param]
+                                        for param in params)
+        start = 0
+        while (True):
+            table = ESFReader.read_hdf5_columns(
+                filename, ('UT1_UNIX', 'GDALT') + columns,
+                slice(start, start + rows))
+            ut = table['UT1_UNIX']
+            if (not len(ut)):
+                return stats
+            end = len(ut)
+            if (end == rows):
+                # The last profile may go on past the slice, so it is left
+                # for the next one
+                earlier = np.flatnonzero(ut != ut[-1])
+                if (not len(earlier)):
+                    rows *= 2
+                    continue
+                end = int(earlier[-1]) + 1
+            part = dict((name, values[:end])
+                        for name, values in table.items())
+            grid = ESFGrid.grid_profiles(part, columns)
+            for param in params:
+                stats[param].update_grid(grid, param)
+            start += end
+    for profile in ESFReader.read_profiles(filename):
+        data = profile.data
+        gdalt, first = np.unique(data['GDALT'], return_index = True)
+        for param in params:
+            stats[param].update(data[param][first],
+                                data[ESFGrid.ERRORS[param]][first], gdalt)
+    return stats
+
+
+def accumulate_files(files, params = DRIFTS, processes = None):
+    """
+    Accumulates many exports, one file per worker process, and merges the
+    results.
+
+    Args:
+        files     - A directory, a glob pattern or a list of paths, as for
+                    ESFBatch.find_files
+        params    - The drift parameters to accumulate
+        processes - The number of worker processes. Defaults to the number
+                    of cores. With 1 the files are read in this process.
+
+    Returns:
+        A dict of parameter: GateStats
+    """
+    files = ESFBatch.find_files(files)
+    if (processes is None):
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(files))
+    if (processes <= 1):
+        parts = [accumulate_file(filename, params) for filename in files]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            parts = pool.starmap(accumulate_file,
+                                 [(filename, params) for filename in files])
+    stats = dict((param, GateStats()) for param in params)
+    for part in parts:
+        for param in params:
+            stats[param].merge(part[param])
+    return stats
+
+
+def check(sample = ESFBatch.SAMPLE_FILE, processes = 2):
+    """
+    Checks that accumulate_files on a directory holding two nights, one with
+    both its text and HDF5 exports and one with only its text export, gives
+    the same statistics as accumulating each night once.
+
+    Args:
+        sample    - A text export with its HDF5 export next to it. The
+                    bundled night by default.
+        processes - The number of worker processes, see accumulate_files
+
+    Raises:
+        RuntimeError if the statistics differ
+    """
+    hdf5 = os.path.splitext(sample)[0] + '.hdf5'
+    tmpdir = tempfile.mkdtemp()
+    try:
+        both = os.path.join(tmpdir, 'jul20140820_esf.001')
+        shutil.copy(sample, both + '.txt')
+        shutil.copy(hdf5, both + '.hdf5')
+        text = os.path.join(tmpdir, 'jul20140820_esf.002.txt')
+        shutil.copy(sample, text)
+        stats = accumulate_files(tmpdir, processes = processes)
+        expected = dict((param, GateStats()) for param in DRIFTS)
+        for filename in (both + '.hdf5', text):
+            part = accumulate_file(filename)
+            for param in DRIFTS:
+                expected[param].merge(part[param])
+    finally:
+        shutil.rmtree(tmpdir)
+    for param in DRIFTS:
+        got, want = stats[param], expected[param]
+        if (not np.array_equal(got.count, want.count) or
+                not np.allclose(got.mean, want.mean, equal_nan = True)):
+            raise RuntimeError('accumulate_files counted the nights of {} '
+                               'wrongly: {} values instead of {}'.format(
+                                   param, got.count.sum(), want.count.sum()))
+    print('accumulate_files counted each night once')
+
+
+WINDOWS = (900, 1800, 3600)
+
+Rolling = namedtuple('Rolling', ['count', 'mean', 'variance', 'median'])
+
+
+class _WindowMedian(object):
+    """
+    The median of a window of values which are added and removed one at a
+    time. The lower half of the window is kept in a max-heap and the upper
+    half in a min-heap. Removed values are only counted, and are popped
+    when they reach the top of their heap, so adding and removing a value
+    are O(log w) in the size of the window. Once the heaps hold more
+    removed values than live ones they are rebuilt from the live values,
+    so they never hold more than about twice the window.
+    """
+    def __init__(self):
+        # The lower half is stored negated, as heapq only has min-heaps
+        self.low = []
+        self.high = []
+        self.n_low = 0
+        self.n_high = 0
+        self.removed = collections.Counter()
+
+    def _prune(self, heap, sign):
+        """
+        Pops the removed values off the top of a heap.
+        """
+        while (heap and self.removed[sign * heap[0]]):
+            value = sign * heapq.heappop(heap)
+            self.removed[value] -= 1
+            if (not self.removed[value]):
+                del self.removed[value]
+
+    def _compact(self):
+        """
+        Rebuilds the heaps from the values still in the window.
+        """
+        live = []
+        for value in sorted([-value for value in self.low] + self.high):
+            if (self.removed[value]):
+                self.removed[value] -= 1
+            else:
+                live.append(value)
+        # Sorted lists are valid heaps
+        half = (len(live) + 1) // 2
+        self.low = [-value for value in live[half - 1::-1]]
+        self.high = live[half:]
+        self.n_low, self.n_high = half, len(live) - half
+        self.removed = collections.Counter()
+
+    def _balance(self):
+        """
+        Moves a value between the heaps so the lower half has as many values
+        as the upper half, or one more.
+        """
+        if (self.n_low > self.n_high + 1):
+            heapq.heappush(self.high, -heapq.heappop(self.low))
+            self.n_low -= 1
+            self.n_high += 1
+            self._prune(self.low, -1)
+        elif (self.n_low < self.n_high):
+            heapq.heappush(self.low, -heapq.heappop(self.high))
+            self.n_low += 1
+            self.n_high -= 1
+            self._prune(self.high, 1)
+
+    def add(self, value):
+        if (not self.n_low or value <= -self.low[0]):
+            heapq.heappush(self.low, -value)
+            self.n_low += 1
+        else:
+            heapq.heappush(self.high, value)
+            self.n_high += 1
+        self._balance()
+
+    def remove(self, value):
+        """
+        Removes a value, which must be in the window.
+        """
+        self.removed[value] += 1
+        if (value <= -self.low[0]):
+            self.n_low -= 1
+            self._prune(self.low, -1)
+        else:
+            self.n_high -= 1
+            self._prune(self.high, 1)
+        self._balance()
+        if (len(self.low) + len(self.high) > 2 * (self.n_low + self.n_high) +
+                16):
+            self._compact()
+
+    def median(self):
+        if (not self.n_low):
+            return np.nan
+        if (self.n_low > self.n_high):
+            return -self.low[0]
+        return (-self.low[0] + self.high[0]) / 2
+
+
+class RollingWindow(object):
+    """
+    A trailing time window over profiles which arrive one at a time,
+    keeping the count, mean, variance and median of the values in the
+    window at every gate.
+
+        roller = RollingWindow(1800)
+        for ut, values in profiles:
+            roller.push(ut, values)
+            roller.mean, roller.median
+
+    Each push adds the new profile and drops the profiles which have fallen
+    out of the window, so only the profiles in the window are held. The
+    mean and variance are updated in O(1) per gate, all gates together,
+    with Welford's formulas for adding and removing a value. The median of
+    each gate is kept in a pair of heaps, see _WindowMedian, so it costs
+    O(log w) per value added or removed, where w is the number of profiles
+    in the window.
+
+    Args:
+        window - The window length in seconds. After pushing a profile at
+                 time t the window holds the profiles with
+                 t - window < ut <= t.
+        median - If False no heaps are kept and median is None
+
+    Attributes:
+        count - The number of values in the window at each gate
+    """
+    def __init__(self, window, median = True):
+        self.window = window
+        self.keep_median = median
+        self.profiles = collections.deque()
+        self.count = None
+
+    def _start(self, gates):
+        """
+        Sets up the statistics for the number of gates of the first profile.
+        """
+        self.count = np.zeros(gates, dtype = 'i8')
+        self._mean = np.zeros(gates)
+        self.m2 = np.zeros(gates)
+        self.medians = None
+        if (self.keep_median):
+            self.medians = [_WindowMedian() for _ in range(gates)]
+
+    def _add(self, values, valid):
+        x = values[valid]
+        self.count[valid] += 1
+        delta = x - self._mean[valid]
+        self._mean[valid] += delta / self.count[valid]
+        self.m2[valid] += delta * (x - self._mean[valid])
+        if (self.medians is not None):
+            for gate, value in zip(np.flatnonzero(valid).tolist(),
+                                   x.tolist()):
+                self.medians[gate].add(value)
+
+    def _remove(self, values, valid):
+        x = values[valid]
+        self.count[valid] -= 1
+        n = self.count[valid]
+        delta = x - self._mean[valid]
+        self._mean[valid] -= np.where(n > 0, delta / np.maximum(n, 1),
+                                      self._mean[valid])
+        self.m2[valid] -= delta * (x - self._mean[valid])
+        self.m2[valid] = np.where(n > 1, np.maximum(self.m2[valid], 0), 0)
+        if (self.medians is not None):
+            for gate, value in zip(np.flatnonzero(valid).tolist(),
+                                   x.tolist()):
+                self.medians[gate].remove(value)
+
+    def push(self, ut, values):
+        """
+        Adds the next profile and moves the window on to end at it.
+
+        Args:
+            ut     - The time of the profile in unix seconds, no earlier
+                     than the profile pushed before it
+            values - The values of the profile, shape (gates,), with the
+                     same gates as every other profile. Masked and nan
+                     values are left out.
+
+        Returns:
+            self
+        """
+        values = np.ma.filled(np.ma.asarray(values, dtype = 'f8'), np.nan)
+        if (self.count is None):
+            self._start(len(values))
+        elif (len(values) != len(self.count)):
+            raise ValueError('expected {} gates, got {}'.format(
+                len(self.count), len(values)))
+        if (self.profiles and ut < self.profiles[-1][0]):
+            raise ValueError('profiles must be pushed in time order')
+        valid = np.isfinite(values)
+        self._add(values, valid)
+        self.profiles.append((ut, values, valid))
+        while (self.profiles[0][0] <= ut - self.window):
+            self._remove(*self.profiles.popleft()[1:])
+        return self
+
+    @property
+    def mean(self):
+        """
+        The mean of the window at each gate.
+        """
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    @property
+    def variance(self):
+        """
+        The sample variance of the window at each gate.
+        """
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1),
+                            np.nan)
+
+    @property
+    def median(self):
+        """
+        The median of the window at each gate, or None if medians are not
+        kept.
+        """
+        if (self.medians is None):
+            return None
+        return np.array([median.median() for median in self.medians])
+
+
+def rolling(grid, param = 'VIPE1', windows = WINDOWS, median = True):
+    """
+    Rolling statistics over trailing UT windows, at every profile and gate.
+
+    Args:
+        grid    - An ESFGrid.Grid holding param
+        param   - The parameter
+        windows - The window lengths in seconds, 15, 30 and 60 minutes by
+                  default
+        median  - If False the medians are not worked out, which is faster
+
+    Returns:
+        A dict of window length: Rolling named tuple of (count, mean,
+        variance, median), each an array shaped like grid.data[param]. The
+        statistics are nan where the window has too few values, and median
+        is None when it is not worked out.
+    """
+    results = {}
+    shape = grid.data[param].shape
+    data = np.ma.filled(np.ma.asarray(grid.data[param], dtype = 'f8'),
+                        np.nan)
+    for window in windows:
+        roller = RollingWindow(window, median)
+        count = np.zeros(shape, dtype = 'i8')
+        mean = np.empty(shape)
+        variance = np.empty(shape)
+        medians = np.empty(shape) if median else None
+        for i in range(len(grid.ut)):
+            roller.push(grid.ut[i], data[i])
+            count[i] = roller.count
+            mean[i] = roller.mean
+            variance[i] = roller.variance
+            if (median):
+                medians[i] = roller.median
+        results[window] = Rolling(count, mean, variance, medians)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Check that '
+                                     'accumulate_files reads each night '
+                                     'once.')
+    parser.add_argument('--sample', default = ESFBatch.SAMPLE_FILE)
+    parser.add_argument('--processes', type = int, default = 2)
+    args = parser.parse_args()
+    check(args.sample, args.processes)
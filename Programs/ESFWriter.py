@@ -0,0 +1,262 @@
+"""
+Writes Madrigal style ESF HDF5 files, like jul20140820_esf.001.hdf5, one
+profile at a time as they come in during a campaign.
+
+Records go into a chunked, resizable Data/Table Layout dataset with the same
+compound layout as the Madrigal exports. Appended rows are collected in a
+buffer of one chunk and each full chunk is written with a single resize and
+write, so appending costs the same however large the file has become. The
+partial last chunk, and the start and end times in Metadata/Experiment
+Parameters, are only written when flush is called.
+
+The file is written in HDF5's single-writer/multiple-reader (SWMR) mode, so
+readers can open it while it is being written and see everything up to the
+last flush. ESFReader.read_hdf5_columns opens files in SWMR read mode, or use
+open_for_reading directly.
+"""
+import time
+
+import numpy as np
+
+import ESFReader
+
+LAYOUT_DTYPE = np.dtype([
+    ('year', '<i8'), ('month', '<i8'), ('day', '<i8'), ('hour', '<i8'),
+    ('min', '<i8'), ('sec', '<i8'), ('ut1_unix', '<i8'), ('ut2_unix', '<i8'),
+    ('recno', '<i8'), ('gdlatr', '<f8'), ('gdlonr', '<f8'), ('gdalt', '<f8'),
+    ('snl', '<f8'), ('vipe1', '<f8'), ('dvipe1', '<f8'), ('vipn1', '<f8'),
+    ('dvipn1', '<f8')])
+
+PARAMETERS_DTYPE = np.dtype([('mnemonic', 'S8'), ('description', 'S48'),
+                             ('isError', '<i8'), ('units', 'S3'),
+                             ('category', 'S22')])
+PARAMETERS = [
+    ('YEAR', 'Year (universal time)', 0, 'y', 'Time Related Parameter'),
+    ('MONTH', 'Month (universal time)', 0, 'm', 'Time Related Parameter'),
+    ('DAY', 'Day (universal time)', 0, 'd', 'Time Related Parameter'),
+    ('HOUR', 'Hour (universal time)', 0, 'h', 'Time Related Parameter'),
+    ('MIN', 'Minute (universal time)', 0, 'm', 'Time Related Parameter'),
+    ('SEC', 'Second (universal time)', 0, 's', 'Time Related Parameter'),
+    ('UT1_UNIX', 'Unix seconds (1/1/1970) at start', 0, 's',
+     'Time Related Parameter'),
+    ('UT2_UNIX', 'Unix seconds (1/1/1970) at end', 0, 's',
+     'Time Related Parameter'),
+    ('RECNO', 'Logical Record Number', 0, 'N/A', 'Time Related Parameter'),
+    ('GDLATR', 'Reference geod latitude (N hemi=pos)', 0, 'deg',
+     'Geographic Coordinate'),
+    ('GDLONR', 'Reference geodetic longitude', 0, 'deg',
+     'Geographic Coordinate'),
+    ('GDALT', 'Altitude (height)', 0, 'km', 'Geographic Coordinate'),
+    ('SNL', 'Log10 (signal to noise ratio)', 0, 'N/A',
+     'Data Quality Parameter'),
+    ('VIPE1', 'Ion velocity in direction 4 (perp east)', 0, 'm/s',
+     'Vector Quantity'),
+    ('DVIPE1', 'Error in Ion velocity in direction 4 (perp east)', 1, 'm/s',
+     'Vector Quantity'),
+    ('VIPN1', 'Ion velocity in direction 5 (perp north', 0, 'm/s',
+     'Vector Quantity'),
+    ('DVIPN1', 'Error in Ion velocity in direction 5 (perp north', 1, 'm/s',
+     'Vector Quantity'),
+]
+EXPERIMENT_DTYPE = np.dtype([('name', 'S20'), ('value', 'S69')])
+_TIME_COLUMNS = ('year', 'month', 'day', 'hour', 'min', 'sec')
+
+
+def open_for_reading(filename):
+    """
+    Opens an HDF5 file so that it can be read while a ProfileWriter is
+    still writing to it. Call refresh() on a dataset to see newly flushed
+    rows.
+
+    Args:
+        filename - The path to the HDF5 file
+
+    Returns:
+        An open h5py.File
+    """
+    import h5py
+    return h5py.File(filename, 'r', libver = 'latest', swmr = True)
+
+
+def _format_time(ut):
+    """
+    Formats unix seconds the way Madrigal writes start and end times.
+    """
+    return time.strftime('%Y-%m-%d %H:%M:%S UT', time.gmtime(ut))
+
+
+class ProfileWriter(object):
+    """
+    Appends ESF profiles to a new Madrigal style HDF5 file.
+
+        with ProfileWriter('campaign.hdf5', gdlatr = -11.95,
+                           gdlonr = -76.87) as writer:
+            for profile in ESFReader.read_profiles('night.txt'):
+                writer.append(profile.data, profile.ut)
+                writer.flush()
+
+    Args:
+        filename         - The file to create. An existing file is replaced.
+        chunk_rows       - The number of rows in each chunk of the table
+        compression      - The HDF5 compression filter, e.g. 'gzip', 'lzf'
+                           or None
+        compression_opts - Options for the filter, e.g. the gzip level
+        experiment       - A list of (name, value) pairs for
+                           Metadata/Experiment Parameters, such as
+                           [('instrument', 'JULIA')]. 'start time' and
+                           'end time' are added and kept up to date.
+        values           - Values for columns which are the same for every
+                           row, such as gdlatr and gdlonr
+    """
+    def __init__(self, filename, chunk_rows = 4096, compression = 'gzip',
+                 compression_opts = None, experiment = (), **values):
+        import h5py
+
+        self.filename = filename
+        self.chunk_rows = chunk_rows
+        self.values = dict((name.lower(), value)
+                           for name, value in values.items())
+        self.file = h5py.File(filename, 'w', libver = 'latest')
+        self.table = self.file.create_dataset(
+            ESFReader.HDF5_TABLE, shape = (0,), maxshape = (None,),
+            dtype = LAYOUT_DTYPE, chunks = (chunk_rows,),
+            compression = compression, compression_opts = compression_opts)
+        self.file.create_dataset('Metadata/Data Parameters',
+                                 data = np.array(PARAMETERS,
+                                                 dtype = PARAMETERS_DTYPE))
+        experiment = list(experiment) + [('start time', ''), ('end time', '')]
+        self.experiment = self.file.create_dataset(
+            'Metadata/Experiment Parameters',
+            data = np.array(experiment, dtype = EXPERIMENT_DTYPE))
+        self.file.swmr_mode = True
+
+        self._buffer = np.zeros(chunk_rows, dtype = LAYOUT_DTYPE)
+        self._fill = 0
+        self._chunk_start = 0
+        self._recno = 0
+        self._first_ut = None
+        self._last_ut = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._chunk_start + self._fill
+
+    def _rows(self, data, ut, integration):
+        """
+        Lays out the gates of one profile in the Table Layout dtype.
+
+        Returns:
+            A tuple of the rows and the first and last UT1_UNIX time
+        """
+        columns = getattr(getattr(data, 'dtype', None), 'names', None)
+        if (columns is None):
+            columns = list(data.keys())
+        columns = dict((name.lower(), name) for name in columns)
+        n = len(data[next(iter(columns.values()))])
+        rows = np.empty(n, dtype = LAYOUT_DTYPE)
+        for name in LAYOUT_DTYPE.names:
+            if (name in columns):
+                rows[name] = data[columns[name]]
+            elif (name in self.values):
+                rows[name] = self.values[name]
+            elif (LAYOUT_DTYPE[name].kind == 'f'):
+                rows[name] = np.nan
+            else:
+                rows[name] = 0
+        if (ut is not None):
+            stamp = time.gmtime(ut)[:6]
+            for name, value in zip(_TIME_COLUMNS, stamp):
+                if (name not in columns):
+                    rows[name] = value
+        else:
+            # Each row has its own time, so data may hold several profiles
+            ut = ESFReader.unix_time(dict((name.upper(), rows[name])
+                                          for name in _TIME_COLUMNS))
+        for name, offset in (('ut1_unix', 0), ('ut2_unix', integration)):
+            if (name not in columns and name not in self.values):
+                rows[name] = ut + offset
+        self._recno += 1
+        if ('recno' not in columns):
+            rows['recno'] = self._recno
+        if (not n):
+            return rows, None, None
+        return rows, int(rows['ut1_unix'][0]), int(rows['ut1_unix'][-1])
+
+    def _write_chunk(self):
+        """
+        Writes the full buffer out as the next chunk of the table.
+        """
+        end = self._chunk_start + self.chunk_rows
+        if (self.table.shape[0] < end):
+            self.table.resize((end,))
+        self.table[self._chunk_start:end] = self._buffer
+        self._chunk_start = end
+        self._fill = 0
+
+    def append(self, data, ut = None, integration = 0):
+        """
+        Appends the gates of one profile.
+
+        Args:
+            data        - A structured array or dict of arrays with one entry
+                          per gate, such as the data of an ESFReader.Profile.
+                          Column names may be in any case. Table Layout
+                          columns it does not have are taken from the values
+                          given to the writer, from ut, or else are filled
+                          with nan (or 0 for integers).
+            ut          - The UT time of the profile in unix seconds. Used
+                          for the YEAR to SEC and UT1_UNIX columns unless
+                          data has them. If None, the time of each row is
+                          read from its YEAR to SEC columns.
+            integration - The integration time in seconds. UT2_UNIX, the end
+                          time, is UT1_UNIX plus this, so with the default
+                          of 0 it is the same as UT1_UNIX.
+
+        Returns:
+            Nothing
+        """
+        rows, first_ut, last_ut = self._rows(data, ut, integration)
+        if (first_ut is not None):
+            if (self._first_ut is None):
+                self._first_ut = first_ut
+            self._last_ut = last_ut
+        while (len(rows)):
+            n = min(len(rows), self.chunk_rows - self._fill)
+            self._buffer[self._fill:self._fill + n] = rows[:n]
+            self._fill += n
+            rows = rows[n:]
+            if (self._fill == self.chunk_rows):
+                self._write_chunk()
+
+    def flush(self):
+        """
+        Writes the rows still in the buffer and updates the metadata, then
+        flushes the file so that SWMR readers can see everything appended
+        so far.
+        """
+        end = self._chunk_start + self._fill
+        if (self.table.shape[0] != end):
+            self.table.resize((end,))
+        if (self._fill):
+            self.table[self._chunk_start:end] = self._buffer[:self._fill]
+        if (self._first_ut is not None):
+            experiment = self.experiment[:]
+            experiment['value'][-2] = _format_time(self._first_ut)
+            experiment['value'][-1] = _format_time(self._last_ut)
+            self.experiment[:] = experiment
+        self.table.flush()
+        self.experiment.flush()
+
+    def close(self):
+        """
+        Flushes any remaining rows and closes the file.
+        """
+        if (self.file):
+            self.flush()
+            self.file.close()
+            self.file = None
@@ -1,4 +1,4 @@
-import pdb
+import Tutorial
 
 print("""
 Short Tutorial on Functions - part II
@@ -12,8 +12,7 @@ continue. Remeber you can check a function's docstring by typing
 help( func_name ). Let's jump right into it.
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -85,8 +84,7 @@ def printArgs2(a, b, *args):
     for i, arg in enumerate(args):
         print('Argument', i, 'is equal to', arg)
 
-pdb.set_trace()
-print('\n'*100)
+Tutorial.debug()
 
 print("""
 ###
@@ -153,8 +151,7 @@ def printAll(m, x, b = 0, *args, **kwargs):
     for kwrd, value in kwargs.items():
         print('Keyword Argument', kwrd, 'is equal to', value)
 
-pdb.set_trace()
-print('\n'*100)
+Tutorial.debug()
 
 print("""
 ###
@@ -204,8 +201,7 @@ def addOneBad(data = []):
     data.append(1)
     return data
 
-pdb.set_trace()
-print('\n'*100)
+Tutorial.debug()
 
 print("""
 ###
@@ -240,8 +236,7 @@ def addOneGood(data = None):
     data.append(1)
     return data
 
-pdb.set_trace()
-print('\n'*100)
+Tutorial.debug()
 
 print("""
 ###
@@ -293,8 +288,7 @@ def outer(n):
         return x ** n
     return inner
 
-pdb.set_trace()
-print('\n'*100)
+Tutorial.debug()
 
 print("""
 ###
@@ -312,8 +306,7 @@ name for a function that remembers the values from the enclosing scope even
 when the program flow is no longer in the enclosing scope.
 """)
 
-pdb.set_trace()
-print('\n'*100)
+Tutorial.debug()
 
 print("""
 ###
@@ -357,8 +350,7 @@ def one():
     """
     return 1
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -391,8 +383,7 @@ def resetOne():
         return 1
     return one
 
-pdb.set_trace()
-print('\n'*100)
+Tutorial.debug()
 
 print("""
 ###
@@ -418,6 +409,5 @@ decorator right from the getgo so that the user never sees the functionality of
 one().
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 print('Done...')
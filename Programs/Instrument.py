@@ -0,0 +1,342 @@
+"""
+Lightweight instrumentation of the ESF tools.
+
+Functions decorated with @instrument, and blocks of code wrapped in a
+section, record into a global registry how many times they ran, histograms
+of their wall clock and CPU times and, optionally, the peak number of bytes
+they allocated:
+
+    @instrument
+    def grid_profiles(table, params = MEASURED, ut = None):
+        ...
+
+    with section('load night'):
+        table = ESFReader.read_table(filename)
+
+Nothing is recorded until enable() is called, and until then a decorated
+function costs one extra call and a flag check, well under a microsecond
+(run this module as a script to measure it). Memory tracking uses
+tracemalloc, which slows everything down a lot, so it has to be asked for
+with enable(memory = True).
+
+The registry can be printed as a table with report() or saved as JSON with
+to_json(). Setting the ESF_INSTRUMENT environment variable turns
+instrumentation on at import time and prints the report when the program
+exits, or writes it as JSON if the value ends in .json:
+
+    ESF_INSTRUMENT=1 python ESFBatch.py
+    ESF_INSTRUMENT=timings.json python ReaderBenchmark.py
+"""
+import argparse
+import atexit
+import bisect
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# Upper edges of the histogram buckets in seconds: 1 us to 100 s, with a
+# last bucket for anything slower
+BUCKETS = [1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0, 100.0]
+
+_enabled = False
+_memory = False
+_registry = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class Stats(object):
+    """
+    The measurements of one instrumented function or section.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.wall = 0.0
+        self.wall_min = float('inf')
+        self.wall_max = 0.0
+        self.cpu = 0.0
+        self.wall_hist = [0] * (len(BUCKETS) + 1)
+        self.cpu_hist = [0] * (len(BUCKETS) + 1)
+        self.bytes = 0
+        self.bytes_max = 0
+
+    def add(self, wall, cpu, allocated):
+        self.count += 1
+        self.wall += wall
+        self.wall_min = min(self.wall_min, wall)
+        self.wall_max = max(self.wall_max, wall)
+        self.cpu += cpu
+        self.wall_hist[bisect.bisect_left(BUCKETS, wall)] += 1
+        self.cpu_hist[bisect.bisect_left(BUCKETS, cpu)] += 1
+        if (allocated is not None):
+            self.bytes += allocated
+            self.bytes_max = max(self.bytes_max, allocated)
+
+    def as_dict(self):
+        return {'count': self.count, 'wall': self.wall,
+                'wall_min': self.wall_min if self.count else None,
+                'wall_max': self.wall_max, 'cpu': self.cpu,
+                'wall_hist': self.wall_hist, 'cpu_hist': self.cpu_hist,
+                'bytes': self.bytes, 'bytes_max': self.bytes_max}
+
+
+def enable(memory = False):
+    """
+    Starts recording.
+
+    Args:
+        memory - If True also record the peak bytes allocated, with
+                 tracemalloc. This makes the instrumented code much slower.
+    """
+    global _enabled, _memory
+    _memory = memory
+    if (memory and not tracemalloc.is_tracing()):
+        tracemalloc.start()
+    _enabled = True
+
+
+def disable():
+    """
+    Stops recording. What has been recorded so far is kept.
+    """
+    global _enabled, _memory
+    _enabled = False
+    if (_memory and tracemalloc.is_tracing()):
+        tracemalloc.stop()
+    _memory = False
+
+
+def enabled():
+    """
+    Returns True while recording.
+    """
+    return _enabled
+
+
+def reset():
+    """
+    Empties the registry.
+    """
+    with _lock:
+        _registry.clear()
+
+
+def _stack():
+    """
+    Returns this thread's stack of open measurements.
+    """
+    stack = getattr(_local, 'stack', None)
+    if (stack is None):
+        stack = _local.stack = []
+    return stack
+
+
+class _Measurement(object):
+    """
+    Times the code between __enter__ and __exit__ and records it under name.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.memory = _memory and tracemalloc.is_tracing()
+        if (self.memory):
+            # tracemalloc has a single peak, so the peak so far is passed on
+            # to the enclosing measurement before resetting it
+            current, peak = tracemalloc.get_traced_memory()
+            stack = _stack()
+            if (stack):
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.start_bytes = self.peak = current
+            stack.append(self)
+        self.cpu = time.thread_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        allocated = None
+        if (self.memory and tracemalloc.is_tracing()):
+            stack = _stack()
+            stack.pop()
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            allocated = self.peak - self.start_bytes
+            if (stack):
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+        with _lock:
+            stats = _registry.get(self.name)
+            if (stats is None):
+                stats = _registry[self.name] = Stats(self.name)
+            stats.add(wall, cpu, allocated)
+        return False
+
+
+class _NullSection(object):
+    """
+    The section returned while instrumentation is off.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+def section(name):
+    """
+    Returns a context manager which records the code inside it under name.
+
+    Args:
+        name - The name to record under
+
+    Returns:
+        A context manager
+    """
+    if (not _enabled):
+        return _NULL_SECTION
+    return _Measurement(name)
+
+
+def instrument(func = None, name = None):
+    """
+    Decorates a function so its calls are recorded. Use as @instrument, or
+    @instrument(name = '...') to choose the name it is recorded under. By
+    default this is module.function.
+    """
+    if (func is None):
+        return functools.partial(instrument, name = name)
+    if (name is None):
+        name = '{}.{}'.format(func.__module__, func.__qualname__)
+
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        if (not _enabled):
+            return func(*args, **kwargs)
+        with _Measurement(name):
+            return func(*args, **kwargs)
+    return inner
+
+
+def results():
+    """
+    Returns the registry as a dict of name: dict of measurements.
+    """
+    with _lock:
+        return dict((name, stats.as_dict())
+                    for name, stats in _registry.items())
+
+
+def to_json(filename = None):
+    """
+    Returns the registry as a JSON string, and writes it to filename if one
+    is given.
+    """
+    text = json.dumps({'buckets': BUCKETS, 'results': results()},
+                      indent = 2, sort_keys = True)
+    if (filename is not None):
+        with open(filename, 'w') as f:
+            f.write(text)
+    return text
+
+
+def _bucket_label(i):
+    if (i == len(BUCKETS)):
+        return '>{:g}s'.format(BUCKETS[-1])
+    return '<{:g}s'.format(BUCKETS[i])
+
+
+def report():
+    """
+    Returns the registry as a text table, slowest total wall time first.
+    The histogram column shows how many calls took up to each bucket edge.
+    """
+    rows = sorted(results().items(), key = lambda item: -item[1]['wall'])
+    lines = ['{:<45}{:>8}{:>11}{:>11}{:>11}{:>11}{:>12}  {}'.format(
+        'name', 'calls', 'wall s', 'mean ms', 'max ms', 'cpu s',
+        'peak bytes', 'wall histogram')]
+    for name, r in rows:
+        hist = ' '.join('{}:{}'.format(_bucket_label(i), n)
+                        for i, n in enumerate(r['wall_hist']) if n)
+        lines.append('{:<45}{:>8}{:>11.4f}{:>11.3f}{:>11.3f}{:>11.4f}'
+                     '{:>12}  {}'.format(
+                         name, r['count'], r['wall'],
+                         1e3 * r['wall'] / max(r['count'], 1),
+                         1e3 * r['wall_max'], r['cpu'], r['bytes_max'],
+                         hist))
+    return '\n'.join(lines)
+
+
+def _report_at_exit(target):
+    if (target.lower().endswith('.json')):
+        to_json(target)
+    else:
+        sys.stderr.write(report() + '\n')
+
+
+def benchmark(number = 1000000):
+    """
+    Measures the cost per call of an instrumented function that does
+    nothing, with instrumentation off, on, and on with memory tracking, and
+    of an empty section while instrumentation is off.
+
+    Returns:
+        A dict of the extra time per call in nanoseconds over a plain call
+    """
+    def plain():
+        pass
+
+    wrapped = instrument(plain, name = 'benchmark')
+
+    def per_call(func):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        return (time.perf_counter() - start) / number * 1e9
+
+    def in_section():
+        with section('benchmark'):
+            pass
+
+    was_enabled, had_memory = _enabled, _memory
+    disable()
+    base = per_call(plain)
+    overhead = {'disabled': per_call(wrapped) - base,
+                'disabled section': per_call(in_section) - base}
+    enable()
+    overhead['enabled'] = per_call(wrapped) - base
+    disable()
+    enable(memory = True)
+    overhead['enabled with memory'] = per_call(wrapped) - base
+    disable()
+    with _lock:
+        _registry.pop('benchmark', None)
+    if (was_enabled):
+        enable(had_memory)
+
+    print('plain call {:.0f} ns'.format(base))
+    for name, ns in overhead.items():
+        print('{:<22}{:>10.0f} ns extra per call'.format(name, ns))
+    return overhead
+
+
+if (os.environ.get('ESF_INSTRUMENT')):
+    enable()
+    atexit.register(_report_at_exit, os.environ['ESF_INSTRUMENT'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Measure the overhead of '
+                                     'instrumentation.')
+    parser.add_argument('--number', type = int, default = 1000000)
+    args = parser.parse_args()
+    benchmark(args.number)
@@ -0,0 +1,372 @@
+"""
+Memoization for expensive functions such as gridding and fitting.
+
+Function v2.py shows how a decorator wraps a function in an inner function
+which keeps state in a closure. memoize is such a decorator: the closure holds
+a cache of results keyed on the arguments, so a repeated call on the same ESF
+window is answered from memory instead of being computed again.
+
+    @memoize(maxsize = 32, maxbytes = 256 * 2**20, ttl = 600)
+    def grid_window(table):
+        return ESFGrid.grid_profiles(table)
+
+Arguments which are numpy arrays, including masked arrays and memory maps, are
+keyed on a hash of their dtype, shape and contents, so two different arrays
+with the same values hit the same entry. Containers, including sets, are
+keyed item by item, and other arguments are keyed on their value if they are
+hashable and on their pickled bytes if not.
+
+The cache holds at most maxsize entries and maxbytes bytes of results, and
+throws out the least recently used entries to stay within both. Entries older
+than ttl seconds are not used. The wrapped function gets cache_info() and
+cache_clear() methods like functools.lru_cache.
+
+Results are returned as is, not copied, so a cached array should not be
+changed in place by the caller.
+
+disk_memoize keeps the cache on disk instead, so results survive between
+batch jobs and are shared by every process using the same cache directory.
+As Reading_Writing suggests, the arguments are turned into a key by pickling
+them (after hashing any arrays), and each result is stored under the hash of
+that key:
+
+    cache_dir/<module.function>/<first two hex digits>/<hash>.pkl
+
+Results are saved with PickleState, so their arrays are memory mapped when
+they are loaded rather than read in. While an entry is being computed its
+.lock file is held with flock, so workers asking for the same entry wait for
+it instead of computing it again. The least recently used entries are removed
+to keep the whole cache directory below max_bytes.
+"""
+import collections
+import functools
+import glob
+import hashlib
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import ESFCache
+import PickleState
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses',
+                                                 'evictions', 'currsize',
+                                                 'nbytes'])
+
+DISK_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'memoize_cache')
+DISK_MAX_BYTES = 4 * 2**30
+_MISSING = object()
+
+
+def _array_digest(a):
+    """
+    Returns a hex digest of the dtype, shape and contents of an array.
+    """
+    h = hashlib.blake2b(digest_size = 20)
+    h.update(str((a.dtype.str, a.dtype.descr, a.shape)).encode('utf-8'))
+    if (a.dtype.hasobject):
+        h.update(pickle.dumps(a, protocol = pickle.HIGHEST_PROTOCOL))
+    elif (a.size):
+        h.update(np.ascontiguousarray(a).reshape(-1).view(np.uint8))
+    return h.hexdigest()
+
+
+def freeze(obj):
+    """
+    Turns an argument into a hashable value which is equal for equal
+    arguments.
+
+    Args:
+        obj - Any argument. numpy arrays are replaced by a hash of their
+              contents, lists, tuples, dicts, sets and frozensets are frozen
+              item by item and other unhashable objects are replaced by a
+              hash of their pickle.
+
+    Returns:
+        A hashable value
+    """
+    if (isinstance(obj, np.ma.MaskedArray)):
+        return ('masked', _array_digest(np.ma.getdata(obj)),
+                _array_digest(np.ma.getmaskarray(obj)))
+    if (isinstance(obj, np.ndarray)):
+        return ('ndarray', _array_digest(obj))
+    if (isinstance(obj, (tuple, list))):
+        return (type(obj).__name__,) + tuple(freeze(item) for item in obj)
+    if (isinstance(obj, (set, frozenset))):
+        # The order of a set depends on PYTHONHASHSEED, so its items are
+        # sorted to give the same key, and disk cache entry, in every process
+        return (type(obj).__name__,) + tuple(sorted(
+            (freeze(item) for item in obj), key = repr))
+    if (isinstance(obj, dict)):
+        # Keys of different types cannot be compared, but their reprs can
+        return ('dict',) + tuple(sorted(((freeze(k), freeze(v))
+                                         for k, v in obj.items()),
+                                        key = repr))
+    try:
+        hash(obj)
+        return obj
+    except TypeError:
+        data = pickle.dumps(obj, protocol = pickle.HIGHEST_PROTOCOL)
+        return ('pickle', hashlib.blake2b(data, digest_size = 20).hexdigest())
+
+
+def make_key(args, kwargs):
+    """
+    Returns the cache key for a call with the given arguments.
+    """
+    return (freeze(args), freeze(kwargs))
+
+
+def nbytes(obj):
+    """
+    Estimates the memory used by a result. Arrays count their data (and
+    mask) and containers count their items.
+    """
+    if (isinstance(obj, np.ma.MaskedArray)):
+        return np.ma.getdata(obj).nbytes + np.ma.getmaskarray(obj).nbytes
+    if (isinstance(obj, np.ndarray)):
+        return obj.nbytes
+    if (isinstance(obj, (tuple, list))):
+        return sys.getsizeof(obj) + sum(nbytes(item) for item in obj)
+    if (isinstance(obj, dict)):
+        return sys.getsizeof(obj) + sum(nbytes(k) + nbytes(v)
+                                        for k, v in obj.items())
+    return sys.getsizeof(obj)
+
+
+class _NoLock(object):
+    """
+    Stands in for a lock when thread safety is not wanted.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def memoize(maxsize = 128, maxbytes = None, ttl = None, thread_safe = False):
+    """
+    Makes a decorator which caches the results of a function.
+
+    Args:
+        maxsize     - The most entries to keep, or None for no limit
+        maxbytes    - The most bytes of results to keep, as estimated by
+                      nbytes, or None for no limit. Results larger than this
+                      are not cached at all.
+        ttl         - The number of seconds an entry stays valid, or None for
+                      entries which never expire
+        thread_safe - If True the cache is guarded by a lock so the function
+                      can be called from several threads. Two threads making
+                      the same call at once may both compute it.
+
+    Returns:
+        A decorator. The decorated function has cache_info() and
+        cache_clear() methods.
+    """
+    def decorator(func):
+        cache = collections.OrderedDict()
+        lock = threading.RLock() if thread_safe else _NoLock()
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'nbytes': 0}
+
+        def remove(key):
+            value, size, expires = cache.pop(key)
+            stats['nbytes'] -= size
+
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            key = make_key(args, kwargs)
+            with lock:
+                if (key in cache):
+                    value, size, expires = cache[key]
+                    if (expires is None or time.monotonic() < expires):
+                        cache.move_to_end(key)
+                        stats['hits'] += 1
+                        return value
+                    remove(key)
+                    stats['evictions'] += 1
+                stats['misses'] += 1
+
+            value = func(*args, **kwargs)
+            size = nbytes(value)
+            if (maxbytes is not None and size > maxbytes):
+                return value
+            expires = None if ttl is None else time.monotonic() + ttl
+            with lock:
+                if (key in cache):
+                    remove(key)
+                cache[key] = (value, size, expires)
+                stats['nbytes'] += size
+                while ((maxsize is not None and len(cache) > maxsize) or
+                       (maxbytes is not None and stats['nbytes'] > maxbytes)):
+                    remove(next(iter(cache)))
+                    stats['evictions'] += 1
+            return value
+
+        def cache_info():
+            """
+            Returns the hits, misses, evictions, number of entries and bytes
+            held by the cache.
+            """
+            with lock:
+                return CacheInfo(stats['hits'], stats['misses'],
+                                 stats['evictions'], len(cache),
+                                 stats['nbytes'])
+
+        def cache_clear():
+            """
+            Empties the cache and resets its counters.
+            """
+            with lock:
+                cache.clear()
+                stats.update(hits = 0, misses = 0, evictions = 0, nbytes = 0)
+
+        inner.cache_info = cache_info
+        inner.cache_clear = cache_clear
+        return inner
+    return decorator
+
+
+def _load_entry(path):
+    """
+    Loads a disk cache entry, returning _MISSING if it is not there or
+    cannot be read, and marks it as recently used.
+    """
+    try:
+        value = PickleState.load(path)
+    except FileNotFoundError:
+        return _MISSING
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+        for name in (path, path + PickleState.BUFFERS_SUFFIX):
+            if (os.path.exists(name)):
+                os.remove(name)
+        return _MISSING
+    for name in (path, path + PickleState.BUFFERS_SUFFIX):
+        try:
+            os.utime(name)
+        except OSError:
+            pass
+    return value
+
+
+def _evict_entries(cache_dir, max_bytes, keep):
+    """
+    Removes the least recently used disk cache entries, with their
+    buffers and lock files, until the cache is no larger than max_bytes.
+
+    Returns:
+        The number of entries removed
+    """
+    removed = ESFCache.evict(cache_dir, max_bytes, keep,
+                             os.path.join('*', '*', '*.pkl*'))
+    entries = set()
+    for path in removed:
+        if (path.endswith(PickleState.BUFFERS_SUFFIX)):
+            path = path[:-len(PickleState.BUFFERS_SUFFIX)]
+        entries.add(path)
+        for name in (path, path + PickleState.BUFFERS_SUFFIX,
+                     path[:-len('.pkl')] + '.lock'):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+    return len(entries)
+
+
+def disk_memoize(cache_dir = DISK_CACHE_DIR, max_bytes = DISK_MAX_BYTES,
+                 version = 0):
+    """
+    Makes a decorator which caches the results of a function on disk, shared
+    between processes and kept between runs.
+
+    Args:
+        cache_dir - The cache directory, shared by every function cached in
+                    it. A memoize_cache directory in the system temporary
+                    directory by default.
+        max_bytes - The cache directory is kept below this size by removing
+                    the least recently used entries. 4 GB by default.
+        version   - Part of every key. Bump it when the function changes so
+                    that its old results are no longer used.
+
+    Returns:
+        A decorator. The decorated function has cache_info() and
+        cache_clear() methods. Arrays in cached results are read-only
+        memory maps.
+    """
+    def decorator(func):
+        name = '{}.{}'.format(func.__module__, func.__qualname__)
+        directory = os.path.join(cache_dir, name)
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            key = pickle.dumps((name, version, make_key(args, kwargs)),
+                               protocol = pickle.HIGHEST_PROTOCOL)
+            digest = hashlib.blake2b(key, digest_size = 20).hexdigest()
+            path = os.path.join(directory, digest[:2], digest + '.pkl')
+            value = _load_entry(path)
+            if (value is not _MISSING):
+                stats['hits'] += 1
+                return value
+
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            with open(os.path.join(os.path.dirname(path),
+                                   digest + '.lock'), 'ab') as lock:
+                if (fcntl is not None):
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    # Another process may have computed it while we waited
+                    value = _load_entry(path)
+                    if (value is not _MISSING):
+                        stats['hits'] += 1
+                        return value
+                    stats['misses'] += 1
+                    value = func(*args, **kwargs)
+                    PickleState.dump(value, path)
+                finally:
+                    if (fcntl is not None):
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+            keep = (path, path + PickleState.BUFFERS_SUFFIX)
+            stats['evictions'] += _evict_entries(cache_dir, max_bytes, keep)
+            return value
+
+        def cache_info():
+            """
+            Returns the hits, misses and evictions in this process, and the
+            number of entries and bytes this function has on disk.
+            """
+            files = glob.glob(os.path.join(directory, '*', '*.pkl*'))
+            size = 0
+            for path in files:
+                try:
+                    size += os.path.getsize(path)
+                except OSError:
+                    pass
+            return CacheInfo(stats['hits'], stats['misses'],
+                             stats['evictions'],
+                             sum(path.endswith('.pkl') for path in files),
+                             size)
+
+        def cache_clear():
+            """
+            Removes every entry of this function from the disk and resets the
+            counters.
+            """
+            shutil.rmtree(directory, ignore_errors = True)
+            stats.update(hits = 0, misses = 0, evictions = 0)
+
+        inner.cache_info = cache_info
+        inner.cache_clear = cache_clear
+        return inner
+    return decorator
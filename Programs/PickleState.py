@@ -0,0 +1,201 @@
+"""
+Saving and loading analysis state, such as ESF grids, with pickle protocol 5
+and out-of-band buffers.
+
+A plain pickle.dump copies every array into the pickle byte stream, and
+pickle.load copies it back out again. Here the arrays are instead handed to
+pickle as out-of-band PickleBuffers and written, each aligned to a 64 byte
+boundary, into a separate .buffers file next to a small pickle holding
+everything else. Loading memory maps the .buffers file and gives pickle views
+into the map, so even multi-GB state loads in about the time it takes to
+read the small pickle, and array data is only read from disk when it is used.
+
+Masked arrays, which pickle their data in-band, are saved as their data and
+mask arrays so they also go out-of-band.
+
+Run this module as a script to compare it with plain pickle.dump/load:
+
+    python PickleState.py --megabytes 512
+"""
+import argparse
+import io
+import mmap
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+
+ALIGNMENT = 64
+BUFFERS_SUFFIX = '.buffers'
+FORMAT_VERSION = 1
+
+
+def _masked_array(data, mask, fill_value):
+    """
+    Rebuilds a masked array from its parts without copying them.
+    """
+    return np.ma.MaskedArray(data, mask = mask, fill_value = fill_value,
+                             copy = False)
+
+
+class _Pickler(pickle.Pickler):
+    """
+    A pickler which splits masked arrays into their data and mask arrays, so
+    that both can be passed out-of-band.
+    """
+    def reducer_override(self, obj):
+        if (type(obj) is np.ma.MaskedArray):
+            return _masked_array, (np.asarray(obj.data),
+                                   np.ma.getmaskarray(obj), obj.fill_value)
+        return NotImplemented
+
+
+def _write_atomic(filename, write):
+    """
+    Calls write with a file object for a temporary file, then moves the
+    temporary file over filename.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def dump(obj, filename):
+    """
+    Saves an object to filename and its array payloads to
+    filename + '.buffers'.
+
+    Args:
+        obj      - Any picklable object, typically a dict or named tuple of
+                   numpy arrays
+        filename - The path of the metadata pickle
+
+    Returns:
+        The total number of bytes written to the .buffers file
+    """
+    buffers = []
+    stream = io.BytesIO()
+    _Pickler(stream, protocol = 5, buffer_callback = buffers.append).dump(obj)
+
+    segments = []
+
+    def write_buffers(f):
+        offset = 0
+        for buf in buffers:
+            raw = buf.raw()
+            pad = -offset % ALIGNMENT
+            f.write(b'\0' * pad)
+            offset += pad
+            f.write(raw)
+            segments.append((offset, raw.nbytes))
+            offset += raw.nbytes
+
+    def write_meta(f):
+        pickle.dump({'version': FORMAT_VERSION, 'segments': segments,
+                     'payload': stream.getvalue()}, f,
+                    protocol = pickle.HIGHEST_PROTOCOL)
+
+    _write_atomic(filename + BUFFERS_SUFFIX, write_buffers)
+    _write_atomic(filename, write_meta)
+    return segments[-1][0] + segments[-1][1] if segments else 0
+
+
+def load(filename, mode = 'r'):
+    """
+    Loads an object saved with dump. Arrays in it are views into a memory
+    map of the .buffers file, so nothing is copied.
+
+    Args:
+        filename - The path of the metadata pickle
+        mode     - 'r' for read-only arrays, or 'c' for copy-on-write arrays
+                   which can be changed in memory without touching the file
+
+    Returns:
+        The saved object
+    """
+    access = {'r': mmap.ACCESS_READ, 'c': mmap.ACCESS_COPY}[mode]
+    with open(filename, 'rb') as f:
+        meta = pickle.load(f)
+    if (meta.get('version') != FORMAT_VERSION):
+        raise ValueError('{} was saved with an unknown format version {}'
+                         .format(filename, meta.get('version')))
+
+    view = memoryview(b'')
+    with open(filename + BUFFERS_SUFFIX, 'rb') as f:
+        if (os.fstat(f.fileno()).st_size > 0):
+            view = memoryview(mmap.mmap(f.fileno(), 0, access = access))
+    buffers = [view[offset:offset + size]
+               for offset, size in meta['segments']]
+    return pickle.loads(meta['payload'], buffers = buffers)
+
+
+def benchmark(megabytes = 256, n_arrays = 8):
+    """
+    Times dump and load against plain pickle.dump and pickle.load on a dict
+    of float arrays, and prints the results.
+
+    Args:
+        megabytes - The total size of the arrays
+        n_arrays  - How many arrays to split that size into
+
+    Returns:
+        A dict of the timings in seconds
+    """
+    size = megabytes * 2**20 // 8 // n_arrays
+    state = dict(('array{}'.format(i), np.random.random(size))
+                 for i in range(n_arrays))
+    tmpdir = tempfile.mkdtemp()
+    plain = os.path.join(tmpdir, 'plain.pkl')
+    oob = os.path.join(tmpdir, 'state.pkl')
+    timings = {}
+    try:
+        start = time.perf_counter()
+        with open(plain, 'wb') as f:
+            pickle.dump(state, f)
+        timings['pickle.dump'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(plain, 'rb') as f:
+            pickle.load(f)
+        timings['pickle.load'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dump(state, oob)
+        timings['PickleState.dump'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        loaded = load(oob)
+        timings['PickleState.load'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for name in loaded:
+            loaded[name].sum()
+        timings['PickleState.load + read all'] = (
+            timings['PickleState.load'] + time.perf_counter() - start)
+        del loaded
+    finally:
+        for name in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+    print('{} MB in {} arrays'.format(megabytes, n_arrays))
+    for name, seconds in timings.items():
+        print('{:<30}{:>10.4f} s'.format(name, seconds))
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compare PickleState with '
+                                     'plain pickle.dump/load.')
+    parser.add_argument('--megabytes', type = int, default = 256)
+    parser.add_argument('--arrays', type = int, default = 8)
+    args = parser.parse_args()
+    benchmark(args.megabytes, args.arrays)
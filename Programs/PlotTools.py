@@ -0,0 +1,394 @@
+"""
+Plotting helpers for large ESF datasets.
+
+A full night of VIPE1 against time is tens of thousands of points per line,
+far more than the axes have pixels, and drawing, panning and zooming all slow
+down with the number of vertices. The plot function below decimates the data
+to about one point per pixel column before handing it to matplotlib, and
+decimates again from the full data whenever the x limits change, so zooming
+in still shows every point.
+
+Two decimation modes are available:
+
+-> lttb     Largest-Triangle-Three-Buckets. Picks one point per bucket so
+            that the triangle it makes with its neighbours is as large as
+            possible, which keeps the visual shape of the line.
+-> minmax   Keeps the first, last, smallest and largest point in each pixel
+            column, so no spike is ever lost.
+
+Points where y is nan or masked are dropped before decimating.
+
+RTIPlot draws a range-time-intensity map, such as SNL against time and GDALT,
+as a QuadMesh which is updated in place when the time window, colour limits
+or colormap change, instead of calling pcolormesh again.
+
+matplotlib is only imported by the functions that draw.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import Instrument
+
+
+def _finite(x, y):
+    """
+    Returns float arrays of x and y with the nan and masked points removed,
+    along with the original index of each remaining point.
+    """
+    x = np.asarray(x, dtype = 'f8')
+    y = np.ma.filled(np.ma.asarray(y, dtype = 'f8'), np.nan)
+    index = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    return x[index], y[index], index
+
+
+@Instrument.instrument
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets decimation.
+
+    Args:
+        x     - The x values, in increasing order
+        y     - The y values
+        n_out - The number of points to keep, at least 3
+
+    Returns:
+        The sorted indices of the points to keep
+    """
+    x, y, index = _finite(x, y)
+    n = len(x)
+    if (n_out >= n or n_out < 3):
+        return index
+    edges = np.linspace(1, n - 1, n_out - 1).astype('intp')
+    keep = np.empty(n_out, dtype = 'intp')
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        if (i + 2 < len(edges)):
+            nxt = slice(edges[i + 1], edges[i + 2])
+            cx, cy = x[nxt].mean(), y[nxt].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - cx) * (y[start:stop] - ay) -
+                      (ax - x[start:stop]) * (cy - ay))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return index[keep]
+
+
+@Instrument.instrument
+def minmax(x, y, n_bins, xlim = None):
+    """
+    Min/max envelope decimation over equal width bins in x.
+
+    Args:
+        x      - The x values, in increasing order
+        y      - The y values
+        n_bins - The number of bins, usually the axes width in pixels
+        xlim   - The (low, high) x range to bin over. The range of x by
+                 default. Points outside it are left out.
+
+    Returns:
+        The sorted indices of the points to keep
+    """
+    x, y, index = _finite(x, y)
+    if (xlim is not None):
+        inside = slice(np.searchsorted(x, xlim[0], 'left'),
+                       np.searchsorted(x, xlim[1], 'right'))
+        x, y, index = x[inside], y[inside], index[inside]
+    n = len(x)
+    if (n <= 4 * n_bins or n_bins < 1):
+        return index
+    if (xlim is None):
+        xlim = (x[0], x[-1])
+    edges = np.linspace(xlim[0], xlim[1], n_bins + 1)
+    starts = np.unique(np.searchsorted(x, edges[:-1], 'left').clip(0, n - 1))
+    counts = np.diff(np.r_[starts, n])
+    bins = np.repeat(np.arange(len(starts)), counts)
+    lows = np.minimum.reduceat(y, starts)[bins]
+    highs = np.maximum.reduceat(y, starts)[bins]
+
+    def first(mask):
+        i = np.flatnonzero(mask)
+        return i[np.r_[True, bins[i][1:] != bins[i][:-1]]]
+
+    keep = np.concatenate([starts, starts + counts - 1, first(y == lows),
+                           first(y == highs)])
+    return index[np.unique(keep)]
+
+
+MODES = {'lttb': lttb, 'minmax': minmax}
+
+
+def decimate(x, y, n, mode = 'lttb'):
+    """
+    Decimates a line to about n points.
+
+    Args:
+        x    - The x values, in increasing order
+        y    - The y values
+        n    - The target size, usually the axes width in pixels. minmax can
+               return up to 4 points per bin.
+        mode - 'lttb' or 'minmax'
+
+    Returns:
+        A tuple (x, y) of the decimated values
+    """
+    index = MODES[mode](x, y, n)
+    return np.asarray(x)[index], np.ma.filled(np.ma.asarray(y), np.nan)[index]
+
+
+@Instrument.instrument
+def plot(ax, x, y, *args, **kwargs):
+    """
+    Plots a line like ax.plot, but decimated to the pixel width of the axes.
+    The line is decimated again from the full data whenever the x limits or
+    the figure size change.
+
+    Args:
+        ax     - The axes to plot on
+        x      - The x values. Sorted first if they are not in order.
+        y      - The y values
+        args   - Passed on to ax.plot, e.g. a format string
+        mode   - Keyword only, 'lttb' (the default) or 'minmax'
+        kwargs - Passed on to ax.plot
+
+    Returns:
+        The Line2D that was added
+    """
+    mode = kwargs.pop('mode', 'lttb')
+    x = np.asarray(x, dtype = 'f8')
+    y = np.ma.filled(np.ma.asarray(y, dtype = 'f8'), np.nan)
+    if (np.any(x[1:] < x[:-1])):
+        order = np.argsort(x, kind = 'stable')
+        x, y = x[order], y[order]
+
+    def width():
+        return max(int(ax.bbox.width), 3)
+
+    line, = ax.plot(*(decimate(x, y, width(), mode) + args), **kwargs)
+
+    def update(*_):
+        low, high = sorted(ax.get_xlim())
+        start = max(int(np.searchsorted(x, low, 'left')) - 1, 0)
+        stop = int(np.searchsorted(x, high, 'right')) + 1
+        xv, yv = x[start:stop], y[start:stop]
+        if (mode == 'minmax'):
+            # minmax leaves out the points either side of the limits, which
+            # keep the line running off the edges of the axes
+            index = minmax(xv, yv, width(), (low, high))
+            if (len(xv)):
+                index = np.union1d(index, [0, len(xv) - 1])
+        else:
+            index = lttb(xv, yv, width())
+        line.set_data(xv[index], yv[index])
+
+    ax.callbacks.connect('xlim_changed', update)
+    ax.figure.canvas.mpl_connect('resize_event', update)
+    return line
+
+
+def _edges(centres):
+    """
+    Returns the cell edges around a sorted array of cell centres, halfway
+    between neighbours and extended by half a cell at each end.
+    """
+    centres = np.asarray(centres, dtype = 'f8')
+    if (len(centres) == 1):
+        return centres + [-0.5, 0.5]
+    middle = (centres[1:] + centres[:-1]) / 2
+    return np.r_[2 * centres[0] - middle[0], middle,
+                 2 * centres[-1] - middle[-1]]
+
+
+def _masked_nan(shape):
+    """
+    Returns a fully masked float array. Unlike np.ma.masked_all the data
+    under the mask is nan rather than uninitialized memory, which
+    matplotlib would warn about when it normalizes the colours.
+    """
+    return np.ma.masked_array(np.full(shape, np.nan), mask = True)
+
+
+def _time_label(value, pos = None):
+    """
+    Formats unix seconds on a time axis as UT hours and minutes.
+    """
+    return time.strftime('%H:%M', time.gmtime(value))
+
+
+class RTIPlot(object):
+    """
+    A range-time-intensity map, such as SNL against time and GDALT, drawn
+    as a single QuadMesh which is kept and updated in place.
+
+        rti = RTIPlot(ax, grid.ut, grid.gdalt, grid.data['SNL'],
+                      window = (start, start + 3600))
+        rti.set_window(start + 3600, start + 7200)
+        rti.set_clim(-1, 2)
+        rti.set_cmap('jet')
+
+    Moving the time window only changes the coordinates and values of the
+    existing mesh, and changing the colour limits or colormap only changes
+    its norm or colormap, so stepping through a season does not rebuild the
+    mesh. The mesh has as many columns as the largest window shown so far;
+    unused columns are masked and have zero width. It is only rebuilt when a
+    window needs more columns than that.
+
+    Args:
+        ax         - The axes to draw on
+        ut         - The profile times in unix seconds, in increasing order
+        gdalt      - The gate altitudes, in increasing order
+        data       - The values, shaped (len(ut), len(gdalt)). Masked or nan
+                     values are not drawn.
+        window     - The (start, stop) time range to show, in unix seconds.
+                     All the data by default.
+        cmap       - The colormap
+        clim       - The (vmin, vmax) colour limits. The 1st and 99th
+                     percentiles of the data by default.
+        rasterized - If True the mesh is drawn as an image when saving to a
+                     vector format such as PDF, which keeps the file small
+        kwargs     - Passed on to ax.pcolormesh
+    """
+    def __init__(self, ax, ut, gdalt, data, window = None, cmap = None,
+                 clim = None, rasterized = False, **kwargs):
+        self.ax = ax
+        self.ut = np.asarray(ut)
+        self.data = np.ma.masked_invalid(np.ma.asarray(data, dtype = 'f8'))
+        self.time_edges = _edges(self.ut)
+        self.gdalt_edges = _edges(gdalt)
+        if (clim is None):
+            clim = np.percentile(self.data.compressed(), [1, 99])
+        self.kwargs = dict(kwargs, cmap = cmap, vmin = clim[0],
+                           vmax = clim[1], rasterized = rasterized)
+        self.mesh = None
+        self.start, self.stop = 0, len(self.ut)
+        ax.set_ylim(self.gdalt_edges[0], self.gdalt_edges[-1])
+        ax.xaxis.set_major_formatter(_time_label)
+        ax.set_xlabel('UT')
+        ax.set_ylabel('GDALT (km)')
+        if (window is None):
+            self._update(0, len(self.ut))
+        else:
+            self.set_window(*window)
+
+    def _build(self, n):
+        """
+        Replaces the mesh with a new one of n columns.
+        """
+        if (self.mesh is not None):
+            self.kwargs.update(cmap = self.mesh.get_cmap(),
+                               norm = self.mesh.norm)
+            self.kwargs.pop('vmin', None)
+            self.kwargs.pop('vmax', None)
+            self.mesh.remove()
+        x = np.zeros(n + 1)
+        values = _masked_nan((len(self.gdalt_edges) - 1, n))
+        self.mesh = self.ax.pcolormesh(x, self.gdalt_edges, values,
+                                       **self.kwargs)
+
+    def _update(self, start, stop):
+        """
+        Shows rows start to stop of the data.
+        """
+        n = stop - start
+        if (self.mesh is None or self.mesh.get_array().shape[1] < n):
+            self._build(max(n, 1))
+        columns = self.mesh.get_array().shape[1]
+        x = np.empty(columns + 1)
+        x[:n + 1] = self.time_edges[start:stop + 1]
+        x[n + 1:] = x[n]
+        values = _masked_nan((columns, self.data.shape[1]))
+        values[:n] = self.data[start:stop]
+        # QuadMesh has no setter for its coordinates, but draws from the
+        # array get_coordinates returns, so the x edges are changed in place
+        self.mesh.get_coordinates()[..., 0] = x
+        self.mesh.set_array(values.T)
+        self.start, self.stop = start, stop
+        if (n):
+            self.ax.set_xlim(x[0], x[n])
+
+    @Instrument.instrument
+    def set_window(self, start, stop):
+        """
+        Shows the profiles with times from start up to, but not including,
+        stop, in unix seconds.
+        """
+        self._update(int(np.searchsorted(self.ut, start, 'left')),
+                     int(np.searchsorted(self.ut, stop, 'left')))
+        self.ax.figure.canvas.draw_idle()
+
+    def set_clim(self, vmin = None, vmax = None):
+        """
+        Changes the colour limits.
+        """
+        self.mesh.set_clim(vmin, vmax)
+        self.ax.figure.canvas.draw_idle()
+
+    def set_cmap(self, cmap):
+        """
+        Changes the colormap.
+        """
+        self.mesh.set_cmap(cmap)
+        self.ax.figure.canvas.draw_idle()
+
+
+def _minmax_reference(x, y, n_bins, xlim):
+    """
+    minmax as a loop over the bins, for check.
+    """
+    edges = np.linspace(xlim[0], xlim[1], n_bins + 1)
+    inside = np.flatnonzero((x >= xlim[0]) & (x <= xlim[1]))
+    bins = np.searchsorted(edges, x[inside], 'right') - 1
+    keep = set()
+    for b in np.unique(bins.clip(0, n_bins - 1)):
+        i = inside[bins.clip(0, n_bins - 1) == b]
+        keep.update([i[0], i[-1], i[np.argmin(y[i])], i[np.argmax(y[i])]])
+    return np.array(sorted(keep), dtype = 'intp')
+
+
+def check(n = 100000, n_bins = 100, seed = 0):
+    """
+    Checks minmax against a loop over the bins, for the full range and for
+    x limits which start and end inside the data, and checks that a
+    minmax line can be zoomed.
+
+    Raises:
+        RuntimeError if a check fails
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    x = np.arange(n, dtype = 'f8')
+    y = np.random.default_rng(seed).normal(size = n)
+    for xlim in [(x[0], x[-1]), (10, n // 2), (n // 20, n * 0.6)]:
+        index = minmax(x, y, n_bins, xlim)
+        if (not np.array_equal(index, _minmax_reference(x, y, n_bins, xlim))):
+            raise RuntimeError('minmax differs from the reference for x '
+                               'limits {}'.format(xlim))
+    fig, ax = plt.subplots()
+    try:
+        line = plot(ax, x, y, mode = 'minmax')
+        ax.set_xlim(n // 20, n * 0.6)
+        fig.canvas.draw()
+        shown = line.get_xdata()
+        if (shown[0] > n // 20 or shown[-1] < n * 0.6):
+            raise RuntimeError('the zoomed minmax line does not span the '
+                               'axes')
+    finally:
+        plt.close(fig)
+    print('minmax checks passed')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Check the decimation '
+                                     'of PlotTools.')
+    parser.add_argument('--points', type = int, default = 100000)
+    parser.add_argument('--bins', type = int, default = 100)
+    args = parser.parse_args()
+    check(args.points, args.bins)
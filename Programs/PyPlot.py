@@ -1,8 +1,9 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-from matplotlib.patches import *
-import pdb
+from matplotlib.patches import Rectangle
+
+import Tutorial
 
 print("""
 MatPlotLib Advanced Tutorial
@@ -25,8 +26,7 @@ Some Notes:
    dislike plotting during program execution.
 """)
 
-pause = input("Press [Enter] to continue...")
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -67,8 +67,7 @@ below.
                                left, right, top, and bottom padding.
 """)
 
-pause = input("Press [Enter] to continue...")
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -116,7 +115,7 @@ y1 = np.sin(x)
 y2 = np.cos(x)
 
 fig, (ax1, ax2) = plt.subplots(2, figsize = (10,7))
-fig.canvas.set_window_title('Pyplot Figure Components')
+fig.canvas.manager.set_window_title('Pyplot Figure Components')
 
 plt.subplots_adjust(hspace = 0.4)
 plt.suptitle('Figure title', fontsize = 20)
@@ -144,7 +143,7 @@ ax = fig.add_axes([0,0,1,1])
 ax.xaxis.set_visible(False)
 ax.yaxis.set_visible(False)
 ax.set_zorder(0)
-ax.set_axis_bgcolor((0, 0, 0, 0))
+ax.set_facecolor((0, 0, 0, 0))
 
 ax.add_patch(Rectangle((0.01,0.01),0.98,0.98, fill = False, lw = 2, ec = 'b', transform=ax.transAxes))
 ax.annotate('Figure', (0.02,0.02), textcoords = 'axes fraction',
@@ -173,8 +172,7 @@ ax.annotate('', (0.9,0.32), xytext = (0.84,0.34), xycoords = 'axes fraction',
 plt.show(block = False)
 plt.pause(0.01)
 
-pause = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -188,8 +186,7 @@ call to change its state. Let's look at how we can use these objects to
 create a new figure.
 """)
 
-pause = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -224,8 +221,7 @@ Many of the methods listed above as pyplot methods, such as subplots_adjust or
 draw, can be applied to a specific figure as well.
 """)
 
-pause = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -276,8 +272,7 @@ of (0.3, 0.3). This is useful to putting plots inside plots. Try this out for
 yourself!
 """)
 
-pdb.set_trace()
-print('\n'*100)
+Tutorial.debug()
 
 print("""
 ###
@@ -309,8 +304,7 @@ Feel free to try out some of these. You may have to look up the proper
 procedures online.
 """)
 
-pdb.set_trace()
-print('\n'*100)
+Tutorial.debug()
 
 print("""
 ###
@@ -345,8 +339,7 @@ properties of of the axes
 Try playing with these various features after creating a figure and axes.
 """)
 
-pdb.set_trace()
-print('\n'*100)
+Tutorial.debug()
 
 print("""
 ###
@@ -380,8 +373,7 @@ These components of the axes have the following useful methods.
 Feel free to play with these properties as well.
 """)
 
-pdb.set_trace()
-print('\n'*100)
+Tutorial.debug()
 
 print("""
 ###
@@ -407,8 +399,7 @@ There are hundreds of parameters that can be set, all of which can be seen by
 going here http://matplotlib.org/users/customizing.html.
 """)
 
-pause = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -0,0 +1,712 @@
+"""
+A scriptable version of the plot_case / make_table reader benchmark from the
+Reading_Writing notebook, extended to the storage formats we choose between.
+
+A synthetic table with a chosen mix of float, int and string columns is built
+for every row count, written in each storage format (text, pickle, .npy and
+HDF5 with and without gzip), then read back with each reader. The real ESF
+exports can be added as sources with --esf, and --esf-copies 1 100 also
+reads the text export with its rows repeated 100 times, which is where the
+text readers differ most. Every case records the write time, the size on
+disk, a cold read (the file is first dropped from the page cache where the
+OS allows it) and the min and median of repeated warm reads.
+
+Synthetic tables are generated with vectorized numpy and cached, as .npy and
+as text, under a hash of their parameters, so repeated runs at 10^7 rows and
+more do not spend their time rebuilding the same tables. Use --no-cache to
+rebuild them and time the text writer as well.
+
+The results are saved as JSON along with details of the machine and package
+versions, and a run can be checked against a saved baseline so that slowdowns
+are flagged. For example
+
+    python ReaderBenchmark.py --rows 1000 10000 --floats 10 -o run.json
+    python ReaderBenchmark.py --rows 1000 10000 --floats 10 \\
+        --baseline run.json --threshold 0.2
+
+exits with status 1 if any reader got more than 20% slower. astropy, pandas
+and h5py are only imported when the readers that need them are run.
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import string
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+import BenchmarkInfo
+import ESFCache
+import ESFReader
+
+DEFAULT_ROWS = (100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+ESF_FILES = (os.path.join(DATA_DIR, 'jul20140820_esf.001.txt'),
+             os.path.join(DATA_DIR, 'jul20140820_esf.001.hdf5'))
+
+# Synthetic tables are generated and written this many rows at a time, so
+# memory use does not grow with the table size
+CHUNK_ROWS = 1000000
+# Bump whenever make_table or write_text change their output, so cached
+# synthetic tables are regenerated
+GENERATOR_VERSION = 1
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'reader_benchmark_cache')
+CACHE_MAX_BYTES = 8 * 2**30
+LETTERS = np.frombuffer(string.ascii_letters.encode('ascii'), dtype = 'u1')
+
+
+def read_ascii_python(filename):
+    """
+    astropy's io.ascii reader with the pure Python parser.
+    """
+    from astropy.io import ascii
+    return ascii.read(filename, format = 'basic', guess = False,
+                      fast_reader = False)
+
+
+def read_ascii_fast(filename):
+    """
+    astropy's io.ascii reader with the fast C parser.
+    """
+    from astropy.io import ascii
+    return ascii.read(filename, format = 'basic', guess = False)
+
+
+def read_fast_converter(filename):
+    """
+    astropy's fast C parser with its fast float converter.
+    """
+    from astropy.io import ascii
+    return ascii.read(filename, format = 'basic', guess = False,
+                      fast_reader = {'use_fast_converter': True})
+
+
+def read_pandas(filename):
+    """
+    pandas' read_csv splitting on runs of whitespace, which also handles the
+    padded columns of the ESF text export.
+    """
+    import pandas
+    return pandas.read_csv(filename, sep = r'\s+', header = 0)
+
+
+def read_genfromtxt(filename):
+    """
+    numpy's genfromtxt, taking column names from the header.
+    """
+    return np.genfromtxt(filename, names = True)
+
+
+def read_pickle(filename):
+    """
+    Unpickles a table saved with write_pickle.
+    """
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def read_npy(filename):
+    """
+    Loads a .npy file fully into memory.
+    """
+    return np.load(filename)
+
+
+def read_memmap(filename):
+    """
+    Memory maps a .npy file. Only the header is read, the data is paged in
+    when it is used, so this measures the cost of opening the table.
+    """
+    return np.load(filename, mmap_mode = 'r')
+
+
+def read_hdf5(filename):
+    """
+    Reads the whole table dataset written by write_hdf5.
+    """
+    import h5py
+    with h5py.File(filename, 'r') as f:
+        return f['table'][:]
+
+
+def write_text(table, filename, float_format = None):
+    """
+    Writes a table as space separated text with astropy's fast C writer,
+    CHUNK_ROWS rows at a time so that large memory mapped tables are never
+    converted all at once.
+    """
+    from astropy.io import ascii
+    from astropy.table import Table
+
+    formats = {}
+    if (float_format is not None):
+        formats = dict((name, float_format) for name in table.dtype.names
+                       if name.startswith('f'))
+    with open(filename, 'w') as f:
+        for start in range(0, max(len(table), 1), CHUNK_ROWS):
+            chunk = Table(np.asarray(table[start:start + CHUNK_ROWS]))
+            ascii.write(chunk, f, format = 'basic' if start == 0
+                        else 'no_header', formats = formats,
+                        fast_writer = True)
+
+
+def write_pickle(table, filename):
+    """
+    Pickles a table with the highest protocol.
+    """
+    with open(filename, 'wb') as f:
+        pickle.dump(table, f, protocol = pickle.HIGHEST_PROTOCOL)
+
+
+def write_npy(table, filename):
+    """
+    Saves a table as a .npy file.
+    """
+    np.save(filename, table)
+
+
+def _bytes_strings(table):
+    """
+    h5py cannot store numpy unicode strings, so swap them for byte strings.
+    """
+    descr = [(name, 'S{}'.format(dt.itemsize // 4) if dt.kind == 'U' else dt)
+             for name, dt in ((n, table.dtype[n]) for n in table.dtype.names)]
+    return table.astype(descr)
+
+
+def write_hdf5(table, filename, compression = None):
+    """
+    Saves a table as a single compound HDF5 dataset called table.
+    """
+    import h5py
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('table', data = _bytes_strings(table),
+                         compression = compression)
+
+
+# Storage formats: writer and file extension
+FORMATS = {
+    'text': (write_text, '.txt'),
+    'pickle': (write_pickle, '.pkl'),
+    'npy': (write_npy, '.npy'),
+    'hdf5': (write_hdf5, '.hdf5'),
+    'hdf5-gzip': (functools.partial(write_hdf5, compression = 'gzip'),
+                  '.hdf5'),
+}
+
+# Readers: function, label used in plots and the format they read. The
+# first five are the readers of the notebook.
+READERS = {
+    'ascii-python': (read_ascii_python, 'io.ascii Python', 'text'),
+    'ascii-fast': (read_ascii_fast, 'io.ascii Fast-c', 'text'),
+    'fast-converter': (read_fast_converter, 'Fast converter', 'text'),
+    'pandas': (read_pandas, 'Pandas', 'text'),
+    'genfromtxt': (read_genfromtxt, 'np.genfromtxt', 'text'),
+    'pickle': (read_pickle, 'pickle', 'pickle'),
+    'npy': (read_npy, 'np.load', 'npy'),
+    'memmap': (read_memmap, 'np.load memmap', 'npy'),
+    'hdf5': (read_hdf5, 'h5py', 'hdf5'),
+    'hdf5-gzip': (read_hdf5, 'h5py gzip', 'hdf5-gzip'),
+    'madrigal-hdf5': (ESFReader.read_hdf5_table, 'Madrigal HDF5',
+                      'madrigal-hdf5'),
+    'fixed-width': (ESFReader.read_fixed_width, 'Fixed width', 'esf-text'),
+}
+
+
+def table_dtype(n_floats, n_ints, n_strs, str_val):
+    """
+    Returns the dtype of the tables built by make_table. Strings are stored
+    as bytes, which every format in FORMATS can hold.
+    """
+    width = 10 if str_val == 'random' else max(len(str_val), 1)
+    return np.dtype([('f{}'.format(i), 'f8') for i in range(n_floats)] +
+                    [('i{}'.format(i), 'i8') for i in range(n_ints)] +
+                    [('s{}'.format(i), 'S{}'.format(width))
+                     for i in range(n_strs)])
+
+
+def make_table(size, n_floats, n_ints, n_strs, str_val, seed = None,
+               out = None):
+    """
+    Builds a table of random values with the columns of the notebook's
+    make_table. Every column is generated with vectorized numpy calls,
+    CHUNK_ROWS rows at a time, so tables of 10^7 rows and more are quick to
+    build and can be written straight into a memory map.
+
+    Args:
+        size     - The number of rows
+        n_floats - The number of float columns, uniform between 1 and 10
+        n_ints   - The number of int columns, uniform within +/-9999999
+        n_strs   - The number of string columns
+        str_val  - The value of every string, or 'random' for random 10
+                   letter strings
+        seed     - Seed for the random values. The same seed always gives
+                   the same table.
+        out      - An array of size rows and dtype table_dtype(...) to fill,
+                   such as a memory map. A new array by default.
+
+    Returns:
+        A structured array with columns f0.., i0.. and s0..
+    """
+    if (out is None):
+        out = np.empty(size, dtype = table_dtype(n_floats, n_ints, n_strs,
+                                                 str_val))
+    for chunk, start in enumerate(range(0, size, CHUNK_ROWS)):
+        rng = np.random.default_rng(None if seed is None else [seed, chunk])
+        n = min(CHUNK_ROWS, size - start)
+        rows = slice(start, start + n)
+        for i in range(n_floats):
+            out['f{}'.format(i)][rows] = rng.uniform(1, 10, n)
+        for i in range(n_ints):
+            out['i{}'.format(i)][rows] = rng.integers(-9999999, 9999999, n)
+        for i in range(n_strs):
+            if (str_val == 'random'):
+                codes = LETTERS[rng.integers(0, len(LETTERS), (n, 10))]
+                out['s{}'.format(i)][rows] = codes.view('S10').ravel()
+            else:
+                out['s{}'.format(i)][rows] = str_val.encode('ascii')
+    return out
+
+
+def cached_table(size, n_floats, n_ints, n_strs, float_format, str_val,
+                 seed = 0, cache_dir = CACHE_DIR, max_bytes = CACHE_MAX_BYTES):
+    """
+    Returns a synthetic table and its text file, generating them only if
+    they are not already cached. Entries are named after a hash of all the
+    parameters and GENERATOR_VERSION, and the least recently used entries
+    are removed once the cache grows past max_bytes.
+
+    Args:
+        size         - See make_table
+        n_floats     - See make_table
+        n_ints       - See make_table
+        n_strs       - See make_table
+        float_format - A format string for the float columns of the text
+        str_val      - See make_table
+        seed         - See make_table
+        cache_dir    - The cache directory, in the temp directory by default
+        max_bytes    - The maximum size of the cache directory, 8 GB by
+                       default
+
+    Returns:
+        A tuple (table, filename) of the table, memory mapped from a .npy
+        file, and the path of the same table written as text
+    """
+    params = [size, n_floats, n_ints, n_strs, float_format, str_val, seed,
+              GENERATOR_VERSION]
+    name = hashlib.sha1(json.dumps(params).encode('utf-8')).hexdigest()[:16]
+    npy = os.path.join(cache_dir, name + '.npy')
+    txt = os.path.join(cache_dir, name + '.txt')
+    if (not (os.path.exists(npy) and os.path.exists(txt))):
+        os.makedirs(cache_dir, exist_ok = True)
+        tmp_npy = os.path.join(cache_dir, '.{}.{}.npy'.format(name, os.getpid()))
+        tmp_txt = os.path.join(cache_dir, '.{}.{}.txt'.format(name, os.getpid()))
+        try:
+            table = np.lib.format.open_memmap(
+                tmp_npy, mode = 'w+', shape = (size,),
+                dtype = table_dtype(n_floats, n_ints, n_strs, str_val))
+            make_table(size, n_floats, n_ints, n_strs, str_val, seed, table)
+            table.flush()
+            write_text(table, tmp_txt, float_format)
+            del table
+            os.replace(tmp_txt, txt)
+            os.replace(tmp_npy, npy)
+        finally:
+            for tmp in (tmp_npy, tmp_txt):
+                if (os.path.exists(tmp)):
+                    os.remove(tmp)
+        ESFCache.evict(cache_dir, max_bytes, keep = [npy, txt], pattern = '*')
+    for path in (npy, txt):
+        os.utime(path)
+    return np.load(npy, mmap_mode = 'r'), txt
+
+
+def replicated_esf(filename, copies, cache_dir = CACHE_DIR,
+                   max_bytes = CACHE_MAX_BYTES):
+    """
+    Returns a text export with its rows repeated, to time the text readers
+    on bigger files of the same layout. The copy is kept in the cache
+    directory and only rewritten when the export is newer.
+
+    Args:
+        filename  - The path to an ESF text export
+        copies    - How many times to repeat the rows. 1 returns filename.
+        cache_dir - Where to keep the copy, in the temp directory by default
+        max_bytes - See cached_table
+
+    Returns:
+        The path of the replicated file, with one header line
+    """
+    if (copies == 1):
+        return filename
+    base, ext = os.path.splitext(os.path.basename(filename))
+    path = os.path.join(cache_dir, '{}.x{}{}'.format(base, copies, ext))
+    if (not os.path.exists(path) or
+            os.path.getmtime(path) < os.path.getmtime(filename)):
+        os.makedirs(cache_dir, exist_ok = True)
+        with open(filename, 'rb') as f:
+            header = f.readline()
+            body = f.read()
+        tmp = os.path.join(cache_dir, '.{}.{}{}'.format(base, os.getpid(),
+                                                       ext))
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(header)
+                for _ in range(copies):
+                    f.write(body)
+            os.replace(tmp, path)
+        finally:
+            if (os.path.exists(tmp)):
+                os.remove(tmp)
+        ESFCache.evict(cache_dir, max_bytes, keep = [path], pattern = '*')
+    os.utime(path)
+    return path
+
+
+def default_number(n_rows):
+    """
+    How many reads to time together for a table size, following the
+    notebook's schedule of 10 reads for small tables down to 1 for large.
+    """
+    return max(1, min(10, 2000 // n_rows))
+
+
+def drop_cache(filename):
+    """
+    Asks the OS to drop a file from the page cache, so that the next read
+    comes from disk. Only possible where os.posix_fadvise exists.
+
+    Returns:
+        True if the request was made
+    """
+    if (not hasattr(os, 'posix_fadvise')):
+        return False
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def time_reader(reader, filename, number, repeat):
+    """
+    Times a reader on a file, first once from a cold cache and then warm.
+
+    Args:
+        reader   - A function taking a file name
+        filename - The file to read
+        number   - How many warm reads to time together
+        repeat   - How many times to repeat the warm timing
+
+    Returns:
+        A dict with the cold time (None if the cache could not be dropped)
+        and the min and median warm time per read, all in seconds
+    """
+    cold = None
+    if (drop_cache(filename)):
+        start = time.perf_counter()
+        reader(filename)
+        cold = time.perf_counter() - start
+    times = timeit.repeat(lambda: reader(filename), number = number,
+                          repeat = repeat)
+    times = [t / number for t in times]
+    return {'cold': cold, 'min': min(times),
+            'median': float(np.median(times)), 'number': number,
+            'repeat': repeat}
+
+
+def run_table(table, readers, repeat = 3, number = None, files = None,
+              float_format = None):
+    """
+    Writes a table in the formats the readers need, then times the readers.
+
+    Args:
+        table        - A structured array
+        readers      - The names of the readers to run
+        repeat       - How many times to repeat each timing
+        number       - How many reads to time together, see default_number
+        files        - A dict of format name to an existing file already in
+                       that format. These files are read as they are and get
+                       no write time.
+        float_format - A format string for float columns in the text format
+
+    Returns:
+        A list of result dicts, one per reader
+    """
+    files = files or {}
+    number = number or default_number(len(table))
+    results = []
+    written = {}
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name in readers:
+            reader, _, fmt = READERS[name]
+            if (fmt in files):
+                filename, write = files[fmt], None
+            elif (fmt in written):
+                filename, write = written[fmt]
+            elif (fmt in FORMATS):
+                writer, ext = FORMATS[fmt]
+                if (fmt == 'text'):
+                    writer = functools.partial(writer,
+                                               float_format = float_format)
+                filename = os.path.join(tmpdir, fmt + ext)
+                start = time.perf_counter()
+                writer(table, filename)
+                write = time.perf_counter() - start
+                written[fmt] = filename, write
+            else:
+                continue
+            timing = time_reader(reader, filename, number, repeat)
+            timing.update(reader = name, format = fmt, rows = len(table),
+                          write = write, size = os.path.getsize(filename))
+            results.append(timing)
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def run_suite(rows = DEFAULT_ROWS, n_floats = 10, n_ints = 0, n_strs = 0,
+              float_format = None, str_val = 'abcde12345', readers = None,
+              repeat = 3, number = None, esf_files = (), esf_copies = (1,),
+              cache_dir = CACHE_DIR):
+    """
+    Runs every reader on a synthetic table of each size, and optionally on
+    the real ESF exports.
+
+    Args:
+        rows         - The row counts of the synthetic tables. Empty to skip
+                       the synthetic tables.
+        n_floats     - See make_table
+        n_ints       - See make_table
+        n_strs       - See make_table
+        float_format - A format string for float columns in the text format
+        str_val      - See make_table
+        readers      - The names of the readers to run, all of READERS by
+                       default. fast-converter is skipped without floats.
+        repeat       - How many times to repeat each timing
+        number       - How many reads to time together, see default_number
+        esf_files    - Paths of ESF text and HDF5 exports to benchmark. Text
+                       readers read a text export as it is, the other formats
+                       are written from its parsed table. HDF5 exports are
+                       only read with the madrigal-hdf5 reader.
+        esf_copies   - How many times to repeat the rows of each ESF text
+                       export, one case for each, see replicated_esf. HDF5
+                       exports are only read as they are.
+        cache_dir    - Where to cache the synthetic tables, see cached_table.
+                       With None the tables are rebuilt on every run, which
+                       is the only way to time the text write.
+
+    Returns:
+        A dict with the environment, the case parameters and a list of
+        results, one per source, reader and row count
+    """
+    if (readers is None):
+        readers = list(READERS)
+    synthetic = list(readers)
+    if (n_floats == 0 and 'fast-converter' in synthetic):
+        synthetic.remove('fast-converter')
+    case = {'n_floats': n_floats, 'n_ints': n_ints, 'n_strs': n_strs,
+            'float_format': float_format, 'str_val': str_val}
+    results = []
+    for n_row in rows:
+        if (cache_dir is None):
+            table = make_table(n_row, n_floats, n_ints, n_strs, str_val)
+            files = {}
+        else:
+            table, text = cached_table(n_row, n_floats, n_ints, n_strs,
+                                       float_format, str_val,
+                                       cache_dir = cache_dir)
+            files = {'text': text}
+        for result in run_table(table, synthetic, repeat, number, files,
+                                float_format):
+            result.update(case, source = 'synthetic')
+            results.append(result)
+    for filename in esf_files:
+        if (ESFReader.is_hdf5(filename)):
+            table = ESFReader.read_hdf5_table(filename)
+            cases = [(table, {'madrigal-hdf5': filename})]
+            names = [name for name in readers
+                     if READERS[name][2] == 'madrigal-hdf5']
+        else:
+            table = ESFReader.read_table(filename)
+            cases = []
+            for copies in esf_copies:
+                text = replicated_esf(filename, copies,
+                                      cache_dir or tempfile.gettempdir())
+                cases.append((np.tile(table, copies),
+                              {'text': text, 'esf-text': text}))
+            names = readers
+        for table, files in cases:
+            for result in run_table(table, names, repeat, number, files):
+                result.update(source = os.path.basename(filename))
+                results.append(result)
+    return {'environment': BenchmarkInfo.environment(), 'case': case,
+            'results': results}
+
+
+def _key(result):
+    """
+    Identifies a result by its source, reader, row count and column mix.
+    """
+    return tuple(result.get(name) for name in
+                 ('source', 'reader', 'rows', 'n_floats', 'n_ints', 'n_strs',
+                  'float_format', 'str_val'))
+
+
+def compare(run, baseline, threshold = 0.1):
+    """
+    Compares a run against a baseline run of the same cases.
+
+    Args:
+        run       - The results of run_suite
+        baseline  - Earlier results of run_suite, e.g. loaded from JSON
+        threshold - The fractional slowdown of the median time above which a
+                    case is flagged. 0.1 by default, i.e. 10% slower.
+
+    Returns:
+        A list of dicts describing the flagged cases, slowest first
+    """
+    base = dict((_key(result), result) for result in baseline['results'])
+    regressions = []
+    for result in run['results']:
+        old = base.get(_key(result))
+        if (old is None):
+            continue
+        ratio = result['median'] / old['median']
+        if (ratio > 1 + threshold):
+            regressions.append({'source': result.get('source'),
+                                'reader': result['reader'],
+                                'rows': result['rows'],
+                                'baseline': old['median'],
+                                'median': result['median'], 'ratio': ratio})
+    regressions.sort(key = lambda r: r['ratio'], reverse = True)
+    return regressions
+
+
+def _seconds(value):
+    """
+    Formats a time for format_results, which may be missing.
+    """
+    return '-' if value is None else '{:.3e}'.format(value)
+
+
+def format_results(run):
+    """
+    Lays out the results of run_suite as a text table.
+    """
+    row = '{:<26}{:<16}{:>9}{:>11}{:>12}{:>11}{:>11}{:>11}'
+    lines = [row.format('source', 'reader', 'rows', 'size (B)', 'write (s)',
+                        'cold (s)', 'min (s)', 'median (s)')]
+    for result in run['results']:
+        lines.append(row.format(
+            result.get('source', 'synthetic'), result['reader'],
+            result['rows'], result.get('size', '-'),
+            _seconds(result.get('write')), _seconds(result.get('cold')),
+            _seconds(result['min']), _seconds(result['median'])))
+    return '\n'.join(lines)
+
+
+def plot_results(run, filename):
+    """
+    Makes the notebook's log-log plot of read time against row count for the
+    synthetic tables.
+
+    Args:
+        run      - The results of run_suite
+        filename - The image file to save the plot to
+
+    Returns:
+        Nothing
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    for name, (_, label, _) in READERS.items():
+        points = [(r['rows'], r['min']) for r in run['results']
+                  if r['reader'] == name and
+                  r.get('source', 'synthetic') == 'synthetic']
+        if (points):
+            ax.loglog(*zip(*points), marker = 'o', label = label)
+    ax.grid()
+    ax.legend(loc = 'best')
+    ax.set_title('n_floats={n_floats} n_ints={n_ints} n_strs={n_strs} '
+                 'float_format={float_format}'.format(**run['case']))
+    ax.set_xlabel('Number of rows')
+    ax.set_ylabel('Time (sec)')
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+def main(argv = None):
+    """
+    Command line entry point. Returns the exit status.
+    """
+    parser = argparse.ArgumentParser(description = 'Benchmark table readers '
+                                     'and storage formats.')
+    parser.add_argument('--rows', type = int, nargs = '*',
+                        default = list(DEFAULT_ROWS),
+                        help = 'synthetic table sizes, none to skip them')
+    parser.add_argument('--floats', type = int, default = 10)
+    parser.add_argument('--ints', type = int, default = 0)
+    parser.add_argument('--strs', type = int, default = 0)
+    parser.add_argument('--float-format', default = None)
+    parser.add_argument('--str-val', default = 'abcde12345')
+    parser.add_argument('--readers', nargs = '+', choices = list(READERS))
+    parser.add_argument('--esf', nargs = '*', default = None,
+                        help = 'also benchmark these ESF exports, the '
+                        'bundled ones if no paths are given')
+    parser.add_argument('--esf-copies', type = int, nargs = '+',
+                        default = [1],
+                        help = 'also read the ESF text exports with their '
+                        'rows repeated this many times')
+    parser.add_argument('--cache-dir', default = CACHE_DIR,
+                        help = 'where to cache synthetic tables')
+    parser.add_argument('--no-cache', action = 'store_true',
+                        help = 'rebuild synthetic tables and time text '
+                        'writes')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--number', type = int, default = None)
+    parser.add_argument('-o', '--output', help = 'save the results as JSON')
+    parser.add_argument('--baseline', help = 'JSON results to compare with')
+    parser.add_argument('--threshold', type = float, default = 0.1)
+    parser.add_argument('--plot', help = 'save a log-log plot to this file')
+    args = parser.parse_args(argv)
+
+    esf_files = ()
+    if (args.esf is not None):
+        esf_files = args.esf or ESF_FILES
+    run = run_suite(args.rows, args.floats, args.ints, args.strs,
+                    args.float_format, args.str_val, args.readers,
+                    args.repeat, args.number, esf_files, args.esf_copies,
+                    None if args.no_cache else args.cache_dir)
+    print(format_results(run))
+    if (args.output):
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent = 2)
+    if (args.plot):
+        plot_results(run, args.plot)
+    if (args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(run, json.load(f), args.threshold)
+        for r in regressions:
+            print('REGRESSION {source} {reader} rows={rows}: {baseline:.3e} s'
+                  ' -> {median:.3e} s ({ratio:.2f}x)'.format(**r))
+        if (regressions):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
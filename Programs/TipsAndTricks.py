@@ -1,6 +1,8 @@
 import sys
 import time
 
+import Tutorial
+
 print("""
 Tips and Tricks in Python
 -------------------------
@@ -8,8 +10,7 @@ This is a tutorial which goes over many small and "hidden" features in
 python that are useful to know and use, but otherwise would not be known.
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -30,8 +31,7 @@ respectively. Any text inside these quotes maintains its exact formatting,
 newlines and all.
 ''')
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -55,8 +55,7 @@ If we want to explicitely do integer divison, we can use the // operator as such
 0.0
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -76,28 +75,43 @@ food3 = 'spam'
 
 You could create a new string by the following
 
-grocery_list = food1 + ', ' + food2 + ', ' food3
+grocery_list = food1 + ', ' + food2 + ', ' + food3
 
 which would result in grocery_list being 'milk, eggs, spam'. Rather than
-adding each string together however, you can concatenate them much more
-efficiently by doing the following.
+adding each string together, you can insert them into a template with the %
+operator, known as the interpolation operator.
 
-grocery_list = '%(food1)s, %(food2)s, %(food3)s' % (food1, food2, food3)
+grocery_list = '%s, %s, %s' % (food1, food2, food3)
 
-This process will see the %, known as the interpolation operatorand attempt
-to insert a variable there based on the proceeding variable name in
-parentheses. The s after this indicates the variable is a string (you can use
-i for ints, f for floats, etc.) This will then substitute the food1 variable
-into that component of the string, and do similar procedures for the rest of
-the string. An even more convenient way to do this is to use the locals()
-dict. This is a dict that exists in every instance of a pythin runtime event
-that stores all local variables. Thus the following is viable.
+Each %s is replaced by the next item of the tuple. The s indicates the
+variable is a string (you can use i for ints, f for floats, etc.) The values
+can also be named in parentheses and taken from a dict, such as the locals()
+dict which holds every local variable.
 
 grocery_list = '%(food1)s, %(food2)s, %(food3)s' % locals()
+
+Newer ways of doing the same are str.format, f-strings, and str.join for
+any number of pieces.
+
+grocery_list = '{}, {}, {}'.format(food1, food2, food3)
+grocery_list = f'{food1}, {food2}, {food3}'
+grocery_list = ', '.join([food1, food2, food3])
+
+Which is fastest? TipsBenchmark.py times each of them. On Python 3.11 it
+measured, per piece joined,
+
+pieces       +    += loop   % tuple   % dict   format   f-string   join
+3        57 ns    107 ns     68 ns    138 ns    91 ns      27 ns   25 ns
+1000    243 ns    110 ns     72 ns    134 ns    93 ns      42 ns   13 ns
+
+So for a few strings + is not slow, and % with locals() is the slowest of
+all. What does grow is + on many pieces, since every + copies everything so
+far. For a handful of strings use an f-string, and to join a list of any
+length use ', '.join(pieces), which was 19 times faster than + for 1000
+pieces.
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -113,10 +127,13 @@ In python, you can chain the comparisons as below.
 
 if (5 < x < 10):
     Do Something
+
+This is for readability, not speed. TipsBenchmark.py measured the chained
+form at 33 ns per test on Python 3.11, slightly slower than the 29 ns of
+5 < x and x < 10, since x has to be kept around for the second comparison.
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -133,8 +150,7 @@ _ character.
 25
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -155,8 +171,7 @@ the break was never reached and the for loop ran through all its elements.
 This is a good way to simply check that a for loop completed.
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -175,8 +190,7 @@ In python, you can swap in place with a single line
 a, b = b, a
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -195,8 +209,7 @@ format which mimics this operator.
 x = if_true if conditional else if_false
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -212,10 +225,14 @@ to a 0. The following is valid
 5
 >>> print(5*(x > 10))
 0
+
+This is handy but not a speed trick in plain python. Adding 5*(x < 10) for
+each of 1000 values took 66 ns per value in TipsBenchmark.py on Python 3.11,
+while an if statement took 40 ns. It pays off with numpy arrays, where
+(5*(a < 10)).sum() took 6 ns per value.
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -237,8 +254,7 @@ process is equivalent to
 array([ 0,  2,  4,  6,  8, 10, 12, 14])
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -269,10 +285,14 @@ False
 Note, the last comparison checked if the reference for x was the same as the
 reference for 1000, but there is no referece for 1000! Moral of the story,
 always make sure to use == or is, as appropriate.
+
+Choose between them by meaning, not speed. TipsBenchmark.py on Python 3.11
+measured x is None at 21 ns and x == None at 27 ns. is always takes the same
+time, while == has to look at the values, taking 100 ns for two equal
+strings of 4000 characters and 12 us for two equal lists of 1000 items.
 """)
 
-stop = input('Press [Enter] to continue...')
-print('\n'*100)
+Tutorial.pause()
 
 print("""
 ###
@@ -308,9 +328,9 @@ if (10 > 5 and abs(-1) == 2 and func()):
 The output is nothing! Since abs(-1) != 2, python stops checking the conditions
 and func() is never called. Likewise the print inside the if is also never
 called. This feature is useful if we only want the function to execute under
-certain conditions.
+certain conditions. It also saves time: TipsBenchmark.py measured the first if
+statement at 89 ns and the second, which skips func(), at 48 ns.
 """)
 
-stop = input('Press [Enter] to finish...')
-print('\n'*100)
+Tutorial.pause('Press [Enter] to finish...')
 print('Done...')
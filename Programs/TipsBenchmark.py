@@ -0,0 +1,295 @@
+"""
+Times the performance claims made in TipsAndTricks.py against their
+alternatives, so that the tips can quote measurements.
+
+The claims covered are
+    concat   - building one string from N pieces with +, += in a loop,
+               % with a tuple, % with a dict (as '...' % locals() does),
+               str.format, an f-string and ''.join
+    chained  - 5 < x < 10 against 5 < x and x < 10, over n values
+    and      - an and chain which stops before calling a function, against
+               one which calls it
+    is       - x is y against x == y, for None, ints, strings and lists of
+               n items
+    boolean  - adding 5*(x < 10) against branching with if or a conditional
+               expression, over n values, with numpy for comparison
+
+Each case is timed with timeit, repeated, and the best time is divided by
+the number of items it handles (pieces joined or values tested), so every
+size of a case can be compared per item. Every statement is compiled from
+source, so an f-string with N fields really has N fields, and all the
+variants of a case look up the same globals.
+
+    python TipsBenchmark.py
+    python TipsBenchmark.py --claims concat is --sizes 3 30 300 -o tips.json
+
+prints a table of the time per item in nanoseconds, and how many times
+slower each variant is than the fastest variant of its case and size.
+"""
+import argparse
+import json
+import random
+import sys
+import timeit
+
+import numpy as np
+
+import BenchmarkInfo
+
+DEFAULT_SIZES = (3, 10, 100, 1000)
+CLAIMS = ('concat', 'chained', 'and', 'is', 'boolean')
+# Each timing runs a statement enough times to take at least this long
+MIN_TIME = 0.02
+
+
+class Case(object):
+    """
+    One variant of a claim at one size.
+
+    Args:
+        claim     - The claim, one of CLAIMS
+        variant   - What this variant does
+        size      - The input size, or None if the case has none
+        stmt      - The statement to time, as source
+        namespace - The globals stmt runs with
+        items     - The number of items one run of stmt handles
+    """
+    def __init__(self, claim, variant, size, stmt, namespace, items = 1):
+        self.claim = claim
+        self.variant = variant
+        self.size = size
+        self.stmt = stmt
+        self.namespace = namespace
+        self.items = items
+
+    def time(self, repeat = 5):
+        """
+        Returns the best time per item in seconds.
+        """
+        timer = timeit.Timer(self.stmt, globals = self.namespace)
+        number = 1
+        while (timer.timeit(number) < MIN_TIME):
+            number *= 10
+        best = min(timer.repeat(repeat = repeat, number = number))
+        return best / number / self.items
+
+
+def concat_cases(size):
+    """
+    Returns the cases joining size strings with ', ' between them.
+    """
+    names = ['food{}'.format(i) for i in range(size)]
+    pieces = ['spam{}'.format(i) for i in range(size)]
+    namespace = dict(zip(names, pieces))
+    namespace.update(pieces = pieces, values = dict(namespace),
+                     percent = ', '.join(['%s'] * size),
+                     named = ', '.join('%({})s'.format(name)
+                                       for name in names),
+                     braces = ', '.join(['{}'] * size))
+    args = ', '.join(names)
+    cases = [
+        ('+', " + ', ' + ".join(names)),
+        ('+= loop', "s = pieces[0]\nfor piece in pieces[1:]:\n"
+                    "    s += ', ' + piece"),
+        ('% tuple', 'percent % ({},)'.format(args)),
+        ('% dict', 'named % values'),
+        ('str.format', 'braces.format({})'.format(args)),
+        ('f-string', "f'{}'".format(', '.join('{' + name + '}'
+                                              for name in names))),
+        ("''.join", "', '.join(pieces)"),
+    ]
+    return [Case('concat', variant, size, stmt, namespace, size)
+            for variant, stmt in cases]
+
+
+def _values(size, seed = 0):
+    """
+    Returns size random ints from 0 to 14, a third of them between 5 and 10.
+    """
+    rng = random.Random(seed)
+    return [rng.randrange(15) for _ in range(size)]
+
+
+def chained_cases(size):
+    """
+    Returns the cases testing 5 < x < 10 on size values.
+    """
+    namespace = {'xs': _values(size)}
+    cases = [
+        ('5 < x < 10', 'for x in xs:\n    if (5 < x < 10):\n        pass'),
+        ('5 < x and x < 10', 'for x in xs:\n'
+                             '    if (5 < x and x < 10):\n        pass'),
+    ]
+    return [Case('chained', variant, size, stmt, namespace, size)
+            for variant, stmt in cases]
+
+
+def _func():
+    return True
+
+
+def and_cases():
+    """
+    Returns the cases of the tip's and chain, with and without reaching the
+    function at its end.
+    """
+    namespace = {'func': _func}
+    cases = [
+        ('func() called', 'if (10 > 5 and abs(-1) == 1 and func()):\n'
+                          '    pass'),
+        ('func() skipped', 'if (10 > 5 and abs(-1) == 2 and func()):\n'
+                           '    pass'),
+    ]
+    return [Case('and', variant, None, stmt, namespace)
+            for variant, stmt in cases]
+
+
+def is_cases(sizes):
+    """
+    Returns the cases comparing with is and ==. Each pair of operands is
+    equal but, apart from None and the small int, not the same object, so
+    is and == give different answers for them. Strings and lists of each
+    size are compared as well.
+    """
+    pairs = [
+        ('None', None, None, None),
+        ('small int', None, 10, 10),
+        ('large int', None, 1000, int('1000')),
+    ]
+    for size in sizes:
+        pairs += [
+            ('str', size, 'spam' * size, ''.join(['spam'] * size)),
+            ('list', size, list(range(size)), list(range(size))),
+        ]
+    cases = []
+    for kind, size, a, b in pairs:
+        namespace = {'a': a, 'b': b}
+        cases.append(Case('is', '{} is'.format(kind), size, 'a is b',
+                          namespace))
+        cases.append(Case('is', '{} =='.format(kind), size, 'a == b',
+                          namespace))
+    return cases
+
+
+def boolean_cases(size):
+    """
+    Returns the cases adding 5 for every one of size values below 10.
+    """
+    xs = _values(size)
+    namespace = {'xs': xs, 'a': np.array(xs), 'np': np}
+    cases = [
+        ('t += 5*(x < 10)', 't = 0\nfor x in xs:\n    t += 5*(x < 10)'),
+        ('if x < 10: t += 5', 't = 0\nfor x in xs:\n'
+                              '    if (x < 10):\n        t += 5'),
+        ('t += 5 if x < 10 else 0', 't = 0\nfor x in xs:\n'
+                                    '    t += 5 if x < 10 else 0'),
+        ('numpy 5*(a < 10)', '(5*(a < 10)).sum()'),
+    ]
+    return [Case('boolean', variant, size, stmt, namespace, size)
+            for variant, stmt in cases]
+
+
+def make_cases(claims = CLAIMS, sizes = DEFAULT_SIZES):
+    """
+    Returns the cases of some claims over some sizes.
+    """
+    cases = []
+    for claim in claims:
+        if (claim == 'and'):
+            cases += and_cases()
+            continue
+        if (claim == 'is'):
+            cases += is_cases(sizes)
+            continue
+        for size in sizes:
+            if (claim == 'concat'):
+                cases += concat_cases(size)
+            elif (claim == 'chained'):
+                cases += chained_cases(size)
+            elif (claim == 'boolean'):
+                cases += boolean_cases(size)
+            else:
+                raise ValueError('unknown claim {!r}'.format(claim))
+    return cases
+
+
+def _group(result):
+    """
+    The variants of a case which are compared with each other. For is, that
+    is the is and == of the same kind of operand.
+    """
+    group = (result['claim'], result['size'])
+    if (result['claim'] == 'is'):
+        group += (result['variant'].rsplit(' ', 1)[0],)
+    return group
+
+
+def run(claims = CLAIMS, sizes = DEFAULT_SIZES, repeat = 5):
+    """
+    Times every case of some claims.
+
+    Args:
+        claims - The claims to time, from CLAIMS
+        sizes  - The input sizes to sweep
+        repeat - How many times to repeat each timing, keeping the best
+
+    Returns:
+        A dict of the environment and a list of result dicts, each with the
+        claim, variant, size, time per item in seconds and ratio to the
+        fastest variant
+    """
+    results = []
+    for case in make_cases(claims, sizes):
+        results.append({'claim': case.claim, 'variant': case.variant,
+                        'size': case.size, 'time': case.time(repeat)})
+    fastest = {}
+    for result in results:
+        group = _group(result)
+        fastest[group] = min(fastest.get(group, result['time']),
+                             result['time'])
+    for result in results:
+        result['ratio'] = result['time'] / fastest[_group(result)]
+    return {'environment': BenchmarkInfo.environment(('numpy',)),
+            'results': results}
+
+
+def format_results(run):
+    """
+    Lays out the results of run as a text table.
+    """
+    row = '{:<9}{:<26}{:>7}{:>14}{:>10}'
+    lines = [row.format('claim', 'variant', 'size', 'ns per item',
+                        'x fastest')]
+    for result in run['results']:
+        lines.append(row.format(
+            result['claim'], result['variant'],
+            '-' if result['size'] is None else result['size'],
+            '{:.1f}'.format(result['time'] * 1e9),
+            '{:.2f}'.format(result['ratio'])))
+    return '\n'.join(lines)
+
+
+def main(argv = None):
+    """
+    Command line entry point. Returns the exit status.
+    """
+    parser = argparse.ArgumentParser(description = 'Time the performance '
+                                     'claims of TipsAndTricks.py.')
+    parser.add_argument('--claims', nargs = '+', choices = CLAIMS,
+                        default = list(CLAIMS))
+    parser.add_argument('--sizes', type = int, nargs = '+',
+                        default = list(DEFAULT_SIZES))
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('-o', '--output', help = 'save the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = run(args.claims, args.sizes, args.repeat)
+    print(format_results(results))
+    if (args.output):
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
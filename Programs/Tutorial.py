@@ -0,0 +1,359 @@
+"""
+Runs the tutorial programs (PyPlot.py, TipsAndTricks.py and Function v2.py)
+without stopping, either all the way through or one section at a time.
+
+The tutorials stop between sections with pause(), which waits for [Enter],
+and debug(), which drops into pdb so the reader can try out what was just
+defined. Both do nothing when the TUTORIAL_HEADLESS environment variable is
+set, so a tutorial can also be run straight through with
+
+    TUTORIAL_HEADLESS=1 python TipsAndTricks.py
+
+Run as a script, this module splits a tutorial into sections at its pause()
+and debug() calls, names each section after the heading it prints, and runs
+the sections asked for:
+
+    python Tutorial.py PyPlot.py --list
+    python Tutorial.py PyPlot.py --section Animations
+    python Tutorial.py "Function v2.py"
+
+To run a single section, only the statements of earlier sections which
+define something it uses are run first, so the printed text of the earlier
+sections is skipped. Imports are put off in the same way until the first
+section which uses the names they define, so the matplotlib imports of
+PyPlot.py cost nothing until a section plots. The time they take is counted
+in that section rather than in the startup time.
+
+The startup time, from this module being imported until the first section
+starts, is printed at the end along with the time of each section, and the
+exit status is 1 if the startup time is over the budget (STARTUP_BUDGET
+seconds unless --budget is given).
+"""
+import time
+
+_START = time.perf_counter()
+
+import argparse
+import ast
+import builtins
+import collections
+import os
+import pdb
+import re
+import sys
+import warnings
+
+HEADLESS_VARIABLE = 'TUTORIAL_HEADLESS'
+STARTUP_BUDGET = 0.25
+MARKERS = ('pause', 'debug')
+
+Section = collections.namedtuple('Section', ['name', 'start', 'stop'])
+
+_HEADING = re.compile(r'^###\s*\n##\s*(.+?)\s*\n###', re.MULTILINE)
+_BUILTINS = frozenset(dir(builtins))
+
+
+def headless():
+    """
+    Returns True if the tutorials should run without stopping.
+    """
+    return os.environ.get(HEADLESS_VARIABLE, '') not in ('', '0')
+
+
+def clear():
+    """
+    Scrolls the previous section off the screen.
+    """
+    print('\n'*100)
+
+
+def pause(prompt = 'Press [Enter] to continue...'):
+    """
+    Waits for [Enter] and clears the screen, unless running headless.
+    """
+    if (headless()):
+        return
+    input(prompt)
+    clear()
+
+
+class _Debugger(pdb.Pdb):
+    """
+    pdb, clearing the screen when the reader continues.
+    """
+    def do_continue(self, arg):
+        clear()
+        return pdb.Pdb.do_continue(self, arg)
+
+    do_c = do_cont = do_continue
+
+
+def debug():
+    """
+    Starts pdb in the tutorial at the line after this call, unless running
+    headless. The screen is cleared when the reader continues.
+    """
+    if (headless()):
+        return
+    _Debugger().set_trace(sys._getframe(1))
+
+
+def _is_marker(node):
+    """
+    Returns True if a statement is a call to pause() or debug().
+    """
+    if (not isinstance(node, ast.Expr) or
+            not isinstance(node.value, ast.Call)):
+        return False
+    func = node.value.func
+    if (isinstance(func, ast.Attribute)):
+        return (func.attr in MARKERS and isinstance(func.value, ast.Name) and
+                func.value.id == 'Tutorial')
+    return isinstance(func, ast.Name) and func.id in MARKERS
+
+
+def _binds(node):
+    """
+    Returns the global names a top level statement defines.
+    """
+    if (isinstance(node, (ast.Import, ast.ImportFrom))):
+        return set(alias.asname or alias.name.split('.')[0]
+                   for alias in node.names)
+    if (isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                          ast.ClassDef))):
+        return set([node.name])
+    return set(child.id for child in ast.walk(node)
+               if (isinstance(child, ast.Name) and
+                   isinstance(child.ctx, (ast.Store, ast.Del))))
+
+
+def _loads(node):
+    """
+    Returns the names a top level statement, or anything defined in it,
+    uses, leaving out builtins.
+    """
+    return set(child.id for child in ast.walk(node)
+               if (isinstance(child, ast.Name) and
+                   isinstance(child.ctx, ast.Load))) - _BUILTINS
+
+
+def _heading(nodes):
+    """
+    Returns the first ### heading printed by some statements, or None.
+    """
+    for node in nodes:
+        for child in ast.walk(node):
+            if (isinstance(child, ast.Constant) and
+                    isinstance(child.value, str)):
+                match = _HEADING.search(child.value)
+                if (match):
+                    return match.group(1)
+    return None
+
+
+class Script(object):
+    """
+    A tutorial split into sections.
+
+    Args:
+        filename - The tutorial program
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename) as f:
+            self.body = ast.parse(f.read(), filename).body
+        self.binds = [_binds(node) for node in self.body]
+        self.loads = [_loads(node) for node in self.body]
+        self.imports = [isinstance(node, (ast.Import, ast.ImportFrom))
+                        for node in self.body]
+        self.markers = [_is_marker(node) for node in self.body]
+
+        # A part with no heading of its own, such as the closing 'Done...',
+        # belongs to the section before it
+        self.sections = []
+        start = 0
+        for i in range(len(self.body) + 1):
+            if (i < len(self.body) and not self.markers[i]):
+                continue
+            if (i > start):
+                name = _heading(self.body[start:i])
+                if (not self.sections):
+                    self.sections.append(Section(name or 'Introduction',
+                                                 start, i))
+                elif (name is None):
+                    self.sections[-1] = self.sections[-1]._replace(stop = i)
+                else:
+                    self.sections.append(Section(name, start, i))
+            start = i + 1
+
+    def names(self):
+        """
+        Returns the names of the sections, in order.
+        """
+        return [section.name for section in self.sections]
+
+    def find(self, name):
+        """
+        Returns the section with a name, matched ignoring case. A number is
+        taken as the position of the section, counting from 1, and a part of
+        a name is enough if only one section matches it.
+
+        Raises:
+            ValueError if there is no such section or more than one
+        """
+        if (name.isdigit() and 1 <= int(name) <= len(self.sections)):
+            return self.sections[int(name) - 1]
+        for section in self.sections:
+            if (section.name.lower() == name.lower()):
+                return section
+        matches = [section for section in self.sections
+                   if name.lower() in section.name.lower()]
+        if (len(matches) == 1):
+            return matches[0]
+        raise ValueError('{} has {} section matching {!r}, choose from: {}'
+                         .format(self.filename,
+                                 'more than one' if matches else 'no', name,
+                                 ', '.join(self.names())))
+
+    def prerequisites(self, section, done):
+        """
+        Returns, in order, the statements before a section which have not
+        been run yet but define names it uses, along with the statements
+        those in turn need.
+
+        Args:
+            section - A Section
+            done    - The set of statement indices already run
+        """
+        needed = set()
+        pending = [(name, section.start) for i in self._statements(section)
+                   for name in self.loads[i]]
+        seen = set()
+        while (pending):
+            name, before = pending.pop()
+            if ((name, before) in seen):
+                continue
+            seen.add((name, before))
+            # Only the last definition before the use matters
+            for i in range(before - 1, -1, -1):
+                if (name in self.binds[i] and not self.markers[i]):
+                    if (i not in done and i not in needed):
+                        needed.add(i)
+                        pending.extend((n, i) for n in self.loads[i])
+                    break
+        return sorted(needed)
+
+    def _statements(self, section):
+        """
+        Returns the indices of the statements of a section to run, leaving
+        out the pauses and imports, which are run when first needed.
+        """
+        return [i for i in range(section.start, section.stop)
+                if (not self.markers[i] and not self.imports[i])]
+
+    def run(self, sections = None, namespace = None):
+        """
+        Runs sections of the tutorial headless.
+
+        Args:
+            sections  - The names of the sections to run, in the order to run
+                        them, or None for every section
+            namespace - The globals to run the tutorial in. A new dict by
+                        default.
+
+        Returns:
+            A tuple of the startup time in seconds and a list of (section
+            name, seconds) pairs
+        """
+        os.environ[HEADLESS_VARIABLE] = '1'
+        # Plot to memory rather than opening windows
+        os.environ.setdefault('MPLBACKEND', 'Agg')
+        warnings.filterwarnings('ignore', message = '.*non-interactive')
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        if (directory not in sys.path):
+            sys.path.insert(0, directory)
+        if (namespace is None):
+            namespace = {'__name__': '__main__',
+                         '__file__': self.filename,
+                         '__builtins__': builtins}
+        if (sections is None):
+            chosen = self.sections
+        else:
+            chosen = [self.find(name) for name in sections]
+
+        # from module import * defines unknown names, so it is run up front
+        done = set(i for i, node in enumerate(self.body)
+                   if (isinstance(node, ast.ImportFrom) and
+                       any(alias.name == '*' for alias in node.names)))
+        for i in sorted(done):
+            self._exec(i, namespace)
+
+        startup = None
+        times = []
+        for section in chosen:
+            start = time.perf_counter()
+            if (startup is None):
+                startup = start - _START
+            for i in (self.prerequisites(section, done) +
+                      self._statements(section)):
+                self._exec(i, namespace)
+                done.add(i)
+            times.append((section.name, time.perf_counter() - start))
+        if (startup is None):
+            startup = time.perf_counter() - _START
+        return startup, times
+
+    def _exec(self, i, namespace):
+        module = ast.Module(body = [self.body[i]], type_ignores = [])
+        exec(compile(module, self.filename, 'exec'), namespace)
+
+
+def run(filename, sections = None):
+    """
+    Runs sections of a tutorial headless.
+
+    Args:
+        filename - The tutorial program
+        sections - The names of the sections to run, or None for all of them
+
+    Returns:
+        A tuple of the startup time in seconds and a list of (section name,
+        seconds) pairs
+    """
+    return Script(filename).run(sections)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run a tutorial program '
+                                     'without stopping between sections.')
+    parser.add_argument('filename')
+    parser.add_argument('--section', action = 'append',
+                        help = 'A section to run, by name, part of a name or '
+                        'number. May be given more than once. All sections '
+                        'by default.')
+    parser.add_argument('--list', action = 'store_true',
+                        help = 'List the sections and exit')
+    parser.add_argument('--budget', type = float, default = STARTUP_BUDGET,
+                        help = 'The startup time allowed in seconds')
+    args = parser.parse_args()
+
+    script = Script(args.filename)
+    if (args.list):
+        for i, name in enumerate(script.names()):
+            print('{:>3}  {}'.format(i + 1, name))
+        sys.exit(0)
+    try:
+        for name in args.section or []:
+            script.find(name)
+    except ValueError as e:
+        parser.error(str(e))
+    startup, times = script.run(args.section)
+    sys.stdout.flush()
+    sys.stderr.write('\n')
+    for name, seconds in times:
+        sys.stderr.write('{:<40}{:>9.3f} s\n'.format(name, seconds))
+    sys.stderr.write('{:<40}{:>9.3f} s (budget {:g} s)\n'.format(
+        'startup', startup, args.budget))
+    if (startup > args.budget):
+        sys.stderr.write('startup is over budget\n')
+        sys.exit(1)